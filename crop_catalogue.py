@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Persistent PPM crop catalogue
+Gives every crop a stable identity derived from its ASParam token and
+remembers, per crop, where its table was saved and a hash of its content,
+so repeated runs can skip crops whose table has not changed
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from data_layout import STATE_DIR
+from scraper_core import crop_usage_path, file_lock, safe_name, write_json_atomic
+
+CROP_CATALOGUE_PATH = os.path.join(STATE_DIR, 'crop_catalogue.json')
+
+# Bump when the saved crop CSV changes for the same parsed table (derived columns, metadata,
+# normalisation), so files written by an older version are rewritten instead of skipped
+CROP_OUTPUT_VERSION = 3
+
+
+def crop_id_from_url(url):
+    """Stable crop id: a short hash of the ASParam token in a PLC0101 URL"""
+    token = parse_qs(urlparse(url).query).get('ASParam', [''])[0]
+    if not token:
+        return ''
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16]
+
+
+def table_hash(df):
+    """Hash of a parsed crop table before crop metadata is added, tagged with the output version"""
+    content = f"v{CROP_OUTPUT_VERSION}\n{df.to_csv(index=False)}"
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class CropCatalogue:
+    """JSON file mapping crop id -> name, URL, output path, content hash and fetch time"""
+
+    def __init__(self, path=CROP_CATALOGUE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        """Read the catalogue file; a missing or unreadable file gives an empty catalogue"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable crop catalogue {self.path}: {e}")
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, crop_id):
+        return self.entries.get(crop_id)
+
+    def output_path(self, crop_id, crop_name, base_filename):
+        """Output file for a crop, disambiguated when another crop already owns the sanitized name"""
+        path = crop_usage_path(crop_name, base_filename)
+        with self.lock:
+            for other_id, entry in self.entries.items():
+                if other_id != crop_id and entry.get('path') == path:
+                    return crop_usage_path(f"{safe_name(crop_name)}_{crop_id[:8]}", base_filename)
+        return path
+
+    def has_output(self, crop_id, base_filename):
+        """True when the crop was saved before under this output suffix and the file still exists"""
+        entry = self.get(crop_id)
+        return bool(entry and entry.get('path', '').endswith(base_filename) and os.path.exists(entry['path']))
+
+    def is_unchanged(self, crop_id, content_hash, path):
+        entry = self.get(crop_id)
+        return bool(entry and entry.get('content_hash') == content_hash
+                    and entry.get('path') == path and os.path.exists(path))
+
+    def record(self, crop_id, crop_name, crop_url, path, content_hash, records):
+        """Store the latest result for a crop and persist the catalogue"""
+        with self.lock, file_lock(self.path):
+            # Merge entries written meanwhile by other worker processes
+            self.entries = {**self.entries, **self._load()}
+            self.entries[crop_id] = {
+                'name': crop_name,
+                'url': crop_url,
+                'path': path,
+                'content_hash': content_hash,
+                'records': records,
+                'checked_at': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self.save()
+
+    def save(self):
+        """Write atomically so an interrupted run never leaves a truncated catalogue"""
+        write_json_atomic(self.path, self.entries, indent=1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Layout of the scraped data tree
+Default folders, dataset file patterns, the columns stored as categoricals and where label
+image manifests and derivatives live. Standard library only, so the query
+server can use it without pandas
+"""
+
+import glob
+import os
+
+# Default data tree; every scraper writes below DATA_DIR
+DATA_DIR = 'data'
+PESTICIDES_DIR = f'{DATA_DIR}/pesticides'
+USAGE_DIR = f'{DATA_DIR}/usage'
+REGULATORY_DIR = f'{DATA_DIR}/regulatory'
+STATE_DIR = f'{DATA_DIR}/state'
+
+PESTICIDE_LIST_PATH = f'{REGULATORY_DIR}/taiwan_pesticide_list.csv'
+COMPREHENSIVE_DATA_PATH = f'{REGULATORY_DIR}/taiwan_comprehensive_combined.csv'
+
+# Dataset name -> (glob pattern under the data directory, filename suffixes to exclude)
+DATASETS = {
+    'registrations': (os.path.join('pesticides', '*', '*.csv'), ('_usage_range.csv', '_labels.csv')),
+    'usage_ranges': (os.path.join('pesticides', '*', '*_usage_range.csv'), ('_permit_usage_range.csv',)),
+    'permit_usage_ranges': (os.path.join('pesticides', '*', '*_permit_usage_range.csv'), ()),
+    'crop_usage': (os.path.join('usage', '*.csv'), ()),
+}
+
+# Columns that repeat a few hundred distinct values across the whole registry;
+# they are interned while parsing, categorical in DataFrames and dictionary-encoded on disk
+CATEGORICAL_COLUMNS = frozenset({
+    'data_type', 'pesticide_code', 'pesticide_name', 'formulation_type', 'concentration',
+    'manufacturer', 'foreign_manufacturer', 'registration_status', 'up_status', 'mixture',
+    'crop', 'pest_disease', 'application_method', 'application_timing', 'original_registrar',
+    'data_source', 'fetch_time', 'source_file',
+    'dosage_unit', 'dilution_unit', 'phi_days_unit', 'concentration_unit', 'tolerance_ppm_unit',
+    '作物名稱', '資料來源URL', '擷取時間',
+})
+
+# Per-folder label integrity manifest and cached derivatives (label_integrity.py)
+MANIFEST_NAME = 'manifest.json'
+DERIVED_DIR = 'derived'
+
+# Longest edge in pixels of each cached derivative
+DERIVATIVE_SIZES = {'thumb': 256, 'web': 1600}
+
+
+def in_data_dir(path, data_dir):
+    """A default data path re-rooted under another data directory"""
+    return os.path.join(data_dir, os.path.relpath(path, DATA_DIR))
+
+
+def dataset_files(dataset, data_dir=DATA_DIR):
+    """List the source CSV files of a dataset"""
+    pattern, exclude_suffixes = DATASETS[dataset]
+    files = glob.glob(os.path.join(data_dir, pattern))
+    return [path for path in sorted(files) if not path.endswith(exclude_suffixes)]
+
+
+def derivative_path(image_path, size):
+    """Cached derivative of a label image, e.g. labels/derived/thumb/<name>.jpg"""
+    labels_dir, file_name = os.path.split(image_path)
+    return os.path.join(labels_dir, DERIVED_DIR, size, f"{os.path.splitext(file_name)[0]}.jpg")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped read API for the consolidated dataset
+Opens the Arrow IPC files written by `export.py --format arrow` without
+parsing, giving zero-copy column access and filtered scans by pesticide
+code or crop
+"""
+
+import argparse
+import os
+
+from export import DATASETS, EXPORT_DIR
+
+# Column holding the crop name in each dataset
+CROP_COLUMNS = {
+    'usage_ranges': 'crop',
+    'permit_usage_ranges': 'crop',
+    'crop_usage': '作物名稱',
+}
+
+
+class DatasetReader:
+    """Memory-mapped view over one exported dataset"""
+
+    def __init__(self, dataset, export_dir=EXPORT_DIR):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise SystemExit("Reading Arrow datasets requires the 'pyarrow' package (pip install pyarrow)")
+
+        self.pa = pa
+        self.dataset = dataset
+        self.path = os.path.join(export_dir, f"{dataset}.arrow")
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"{self.path} not found - run: python export.py --format arrow --dataset {dataset}")
+
+        # Only the footer is read here; record batches stay on disk until touched
+        self.source = pa.memory_map(self.path, 'r')
+        self.reader = pa.ipc.open_file(self.source)
+        self.schema = self.reader.schema
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def num_batches(self):
+        return self.reader.num_record_batches
+
+    def table(self):
+        """Whole dataset as a pyarrow Table backed by the memory map"""
+        return self.reader.read_all()
+
+    def column(self, name):
+        """One column as a zero-copy ChunkedArray"""
+        return self.table().column(name)
+
+    def scan(self, column, values, columns=None):
+        """Yield record batches filtered to rows where `column` is in `values`"""
+        import pyarrow.compute as pc
+
+        if column not in self.schema.names:
+            raise ValueError(f"Dataset {self.dataset} has no column {column}")
+
+        value_set = self.pa.array(list(values), type=self.pa.string())
+        for i in range(self.reader.num_record_batches):
+            batch = self.reader.get_batch(i)
+            mask = pc.is_in(batch.column(column), value_set=value_set)
+            if not pc.any(mask).as_py():
+                continue
+            filtered = batch.filter(mask)
+            yield filtered.select(columns) if columns else filtered
+
+    def filter(self, column, values, columns=None):
+        """Filtered rows as one Table"""
+        batches = list(self.scan(column, values, columns))
+        if not batches:
+            schema = self.schema if not columns else self.pa.schema([self.schema.field(c) for c in columns])
+            return schema.empty_table()
+        return self.pa.Table.from_batches(batches)
+
+    def in_range(self, column, low=None, high=None, columns=None):
+        """Rows where a numeric column lies within [low, high]"""
+        import pyarrow.compute as pc
+
+        if column not in self.schema.names:
+            raise ValueError(f"Dataset {self.dataset} has no column {column}")
+
+        batches = []
+        for i in range(self.reader.num_record_batches):
+            batch = self.reader.get_batch(i)
+            values = batch.column(column)
+            mask = pc.is_valid(values)
+            if low is not None:
+                mask = pc.and_(mask, pc.greater_equal(values, low))
+            if high is not None:
+                mask = pc.and_(mask, pc.less_equal(values, high))
+            filtered = batch.filter(mask)
+            batches.append(filtered.select(columns) if columns else filtered)
+        if not batches:
+            return self.schema.empty_table()
+        return self.pa.Table.from_batches(batches)
+
+    def by_pesticide(self, pest_codes, columns=None):
+        """Rows for the given pesticide codes"""
+        return self.filter('pesticide_code', pest_codes, columns)
+
+    def by_crop(self, crops, columns=None):
+        """Rows for the given crop names"""
+        if self.dataset not in CROP_COLUMNS:
+            raise ValueError(f"Dataset {self.dataset} has no crop column")
+        return self.filter(CROP_COLUMNS[self.dataset], crops, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the memory-mapped consolidated dataset')
+    parser.add_argument('dataset', choices=list(DATASETS),
+                        help='Dataset to open')
+    parser.add_argument('--codes', nargs='+',
+                        help='Filter by pesticide codes (e.g., A001 F011)')
+    parser.add_argument('--crops', nargs='+',
+                        help='Filter by crop names')
+    parser.add_argument('--columns', nargs='+',
+                        help='Only return these columns')
+    parser.add_argument('--export-dir', default=EXPORT_DIR,
+                        help=f'Directory holding the .arrow files (default: {EXPORT_DIR})')
+
+    args = parser.parse_args()
+
+    with DatasetReader(args.dataset, args.export_dir) as reader:
+        if args.codes:
+            table = reader.by_pesticide(args.codes, args.columns)
+        elif args.crops:
+            table = reader.by_crop(args.crops, args.columns)
+        else:
+            table = reader.table()
+            if args.columns:
+                table = table.select(args.columns)
+
+        print(f"{table.num_rows} rows")
+        print(table.slice(0, 20).to_pandas().to_string())
+
+
+if __name__ == '__main__':
+    main()
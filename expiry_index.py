@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+ROC (Minguo) date normalization and registration expiry index
+Parses valid dates such as 115-10-22 over whole columns at once and keeps
+every registration sorted by expiry date, so "expiring within N days" and
+"expired but not revoked" are binary searches instead of per-row parsing
+"""
+
+import argparse
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from data_layout import REGULATORY_DIR, dataset_files
+from records import categorize
+
+EXPIRY_INDEX_PATH = os.path.join(REGULATORY_DIR, 'expiry_index.csv')
+ROC_YEAR_OFFSET = 1911
+
+# 115-10-22, 115/10/22 or 115.10.22
+ROC_DATE_PATTERN = r'^\s*(\d{2,3})[-/.](\d{1,2})[-/.](\d{1,2})\s*$'
+
+INDEX_COLUMNS = ['expiry_date', 'permit_number', 'pesticide_code', 'pesticide_name',
+                 'brand_name', 'valid_date', 'registration_status']
+
+
+def parse_roc_dates(values):
+    """Convert a column of ROC date strings to datetime64, unparseable values become NaT"""
+    series = pd.Series(values, dtype='string')
+    parts = series.str.extract(ROC_DATE_PATTERN).astype('float64')
+    return pd.to_datetime(pd.DataFrame({
+        'year': parts[0] + ROC_YEAR_OFFSET,
+        'month': parts[1],
+        'day': parts[2]
+    }), errors='coerce')
+
+
+def to_iso_dates(values):
+    """ROC date strings as ISO 'YYYY-MM-DD' strings ('' when unparseable)"""
+    return parse_roc_dates(values).dt.strftime('%Y-%m-%d').fillna('')
+
+
+def load_registrations(data_dir='data'):
+    """All registration rows across the per-pesticide CSVs"""
+    columns = [c for c in INDEX_COLUMNS if c != 'expiry_date'] + ['data_type']
+    frames = []
+    for file_path in dataset_files('registrations', data_dir):
+        df = pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                         usecols=lambda c: c in columns)
+        if 'data_type' in df:
+            frames.append(df[df['data_type'] == 'registration'])
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return categorize(pd.concat(frames, ignore_index=True).reindex(columns=columns, fill_value=''))
+
+
+def index_is_stale(index_path, data_dir='data'):
+    """True when the index is missing or older than any registration CSV"""
+    if not os.path.exists(index_path):
+        return True
+    built_at = os.path.getmtime(index_path)
+    return any(os.path.getmtime(f) > built_at for f in dataset_files('registrations', data_dir))
+
+
+class ExpiryIndex:
+    """Registrations sorted by parsed expiry date"""
+
+    def __init__(self, frame):
+        frame = frame.dropna(subset=['expiry_date']).sort_values('expiry_date', kind='stable')
+        self.frame = frame.reset_index(drop=True)
+        self.dates = self.frame['expiry_date'].to_numpy(dtype='datetime64[D]')
+
+    @classmethod
+    def build(cls, data_dir='data'):
+        registrations = load_registrations(data_dir)
+        registrations['expiry_date'] = parse_roc_dates(registrations['valid_date'])
+        return cls(registrations[INDEX_COLUMNS])
+
+    @classmethod
+    def load(cls, index_path=EXPIRY_INDEX_PATH):
+        frame = categorize(pd.read_csv(index_path, dtype=str, keep_default_na=False, encoding='utf-8-sig'))
+        frame['expiry_date'] = pd.to_datetime(frame['expiry_date'], errors='coerce')
+        return cls(frame)
+
+    def save(self, index_path=EXPIRY_INDEX_PATH):
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        out = self.frame.copy()
+        out['expiry_date'] = out['expiry_date'].dt.strftime('%Y-%m-%d')
+        out.to_csv(index_path, index=False, encoding='utf-8-sig')
+        return index_path
+
+    def __len__(self):
+        return len(self.frame)
+
+    def between(self, start, end):
+        """Registrations expiring in [start, end)"""
+        lo = np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(self.dates, np.datetime64(end, 'D'), side='left')
+        return self.frame.iloc[lo:hi]
+
+    def expiring_within(self, days, today=None):
+        """Active registrations expiring from today through today + days"""
+        today = np.datetime64(today or date.today(), 'D')
+        rows = self.between(today, today + np.timedelta64(days + 1, 'D'))
+        return rows[rows['registration_status'] != 'expired']
+
+    def expired_not_revoked(self, today=None):
+        """Registrations past their valid date that are still marked active"""
+        today = np.datetime64(today or date.today(), 'D')
+        hi = np.searchsorted(self.dates, today, side='left')
+        rows = self.frame.iloc[:hi]
+        return rows[rows['registration_status'] != 'expired']
+
+
+def print_rows(title, rows):
+    print(f"\n=== {title}: {len(rows)} ===")
+    if len(rows):
+        out = rows.copy()
+        out['expiry_date'] = out['expiry_date'].dt.strftime('%Y-%m-%d')
+        print(out.to_string(index=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the registration expiry index and run expiry queries')
+    parser.add_argument('--data-dir', default='data',
+                        help='Root of the scraped data tree (default: data)')
+    parser.add_argument('--index', default=EXPIRY_INDEX_PATH,
+                        help=f'Expiry index file (default: {EXPIRY_INDEX_PATH})')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild the index even if it is newer than every registration CSV')
+    parser.add_argument('--expiring', type=int, metavar='DAYS',
+                        help='List active permits expiring within DAYS days')
+    parser.add_argument('--expired-active', action='store_true',
+                        help='List permits past their valid date that are not marked revoked')
+    parser.add_argument('--today',
+                        help='Reference date YYYY-MM-DD (default: today)')
+
+    args = parser.parse_args()
+    today = date.fromisoformat(args.today) if args.today else None
+
+    if args.rebuild or index_is_stale(args.index, args.data_dir):
+        index = ExpiryIndex.build(args.data_dir)
+        print(f"Indexed {len(index)} registrations -> {index.save(args.index)}")
+    else:
+        index = ExpiryIndex.load(args.index)
+
+    if args.expiring is not None:
+        print_rows(f"Expiring within {args.expiring} days", index.expiring_within(args.expiring, today))
+    if args.expired_active:
+        print_rows("Expired but not revoked", index.expired_not_revoked(today))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Streaming consolidated export
+Combines the per-pesticide and per-crop CSV outputs into one file per dataset
+(CSV, JSONL, Parquet or Arrow IPC) in bounded-memory chunks, with optional compression
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+
+from data_layout import CATEGORICAL_COLUMNS, DATASETS, dataset_files
+from numeric_fields import NUMERIC_VALUE_COLUMNS
+
+EXPORT_DIR = 'data/export'
+CHUNK_ROWS = 50000
+
+def read_header(file_path):
+    """Read only the header row of a CSV file"""
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        return next(csv.reader(f), [])
+
+
+def unified_columns(files):
+    """Union of all column names in first-seen order, plus the source file column"""
+    columns = {}
+    for file_path in files:
+        for column in read_header(file_path):
+            if column:
+                columns.setdefault(column, None)
+    columns.setdefault('source_file', None)
+    return list(columns)
+
+
+def iter_row_chunks(files, columns, chunk_rows=CHUNK_ROWS):
+    """Yield lists of row dicts aligned to `columns`, at most chunk_rows at a time"""
+    chunk = []
+    for file_path in files:
+        source_file = os.path.relpath(file_path)
+        with open(file_path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                row['source_file'] = source_file
+                chunk.append({column: row.get(column) or '' for column in columns})
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def open_compressed(path, compression):
+    """Open a binary output stream with optional gzip or zstd compression"""
+    if compression == 'gzip':
+        return gzip.open(path, 'wb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("zstd compression requires the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def export_text(files, columns, output_path, output_format, compression):
+    """Stream rows to CSV or JSONL"""
+    row_count = 0
+    with open_compressed(output_path, compression) as raw:
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig' if output_format == 'csv' else 'utf-8', newline='')
+        if output_format == 'csv':
+            writer = csv.DictWriter(text, fieldnames=columns)
+            writer.writeheader()
+        for chunk in iter_row_chunks(files, columns):
+            if output_format == 'csv':
+                writer.writerows(chunk)
+            else:
+                for row in chunk:
+                    text.write(json.dumps(row, ensure_ascii=False) + '\n')
+            row_count += len(chunk)
+        text.flush()
+        text.detach()
+    return row_count
+
+
+def arrow_schema(pa, columns):
+    """Dictionary-encoded categorical columns, float64 parsed numeric values, strings otherwise"""
+    def column_type(column):
+        if column in NUMERIC_VALUE_COLUMNS:
+            return pa.float64()
+        if column in CATEGORICAL_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+
+    return pa.schema([(column, column_type(column)) for column in columns])
+
+
+class ArrowChunkEncoder:
+    """Convert row chunks to Arrow arrays, growing one shared dictionary per categorical column"""
+
+    def __init__(self, pa, columns):
+        self.pa = pa
+        self.columns = columns
+        self.vocabularies = {column: {} for column in columns if column in CATEGORICAL_COLUMNS}
+
+    def encode(self, chunk, column):
+        pa = self.pa
+        if column in NUMERIC_VALUE_COLUMNS:
+            return pa.array([float(row[column]) if row[column] else None for row in chunk], pa.float64())
+        vocabulary = self.vocabularies.get(column)
+        if vocabulary is None:
+            return pa.array([row[column] for row in chunk], pa.string())
+
+        # Later batches only append to the dictionary, so the IPC writer can emit deltas
+        indices = [vocabulary.setdefault(row[column], len(vocabulary)) for row in chunk]
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(vocabulary), pa.string()))
+
+    def arrays(self, chunk):
+        return {column: self.encode(chunk, column) for column in self.columns}
+
+
+def export_parquet(files, columns, output_path, compression):
+    """Stream rows to Parquet one row group per chunk"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export requires the 'pyarrow' package (pip install pyarrow)")
+
+    schema = arrow_schema(pa, columns)
+    encoder = ArrowChunkEncoder(pa, columns)
+    row_count = 0
+    with pq.ParquetWriter(output_path, schema, compression=compression or 'none') as writer:
+        for chunk in iter_row_chunks(files, columns):
+            batch = pa.Table.from_pydict(encoder.arrays(chunk), schema=schema)
+            writer.write_table(batch)
+            row_count += len(chunk)
+    return row_count
+
+
+def export_arrow(files, columns, output_path):
+    """Stream rows to an uncompressed Arrow IPC file that can be memory-mapped"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise SystemExit("Arrow export requires the 'pyarrow' package (pip install pyarrow)")
+
+    schema = arrow_schema(pa, columns)
+    encoder = ArrowChunkEncoder(pa, columns)
+    options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    row_count = 0
+    with pa.OSFile(output_path, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        for chunk in iter_row_chunks(files, columns):
+            batch = pa.RecordBatch.from_pydict(encoder.arrays(chunk), schema=schema)
+            writer.write_batch(batch)
+            row_count += len(chunk)
+    return row_count
+
+
+def export_dataset(dataset, output_format, compression, export_dir=EXPORT_DIR):
+    """Export one dataset, returns (output path, row count) or None when there is no data"""
+    files = dataset_files(dataset)
+    if not files:
+        print(f"  {dataset}: no source files found")
+        return None
+
+    os.makedirs(export_dir, exist_ok=True)
+    extension = {'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet', 'arrow': 'arrow'}[output_format]
+    output_path = os.path.join(export_dir, f"{dataset}.{extension}")
+    if output_format in ('csv', 'jsonl') and compression:
+        output_path += {'gzip': '.gz', 'zstd': '.zst'}[compression]
+
+    columns = unified_columns(files)
+    print(f"  {dataset}: {len(files)} files, {len(columns)} columns")
+
+    if output_format == 'parquet':
+        row_count = export_parquet(files, columns, output_path, compression)
+    elif output_format == 'arrow':
+        row_count = export_arrow(files, columns, output_path)
+    else:
+        row_count = export_text(files, columns, output_path, output_format, compression)
+
+    print(f"  Saved {row_count} rows to {output_path}")
+    return output_path, row_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export all scraped data into consolidated files')
+    parser.add_argument('--dataset', choices=list(DATASETS) + ['all'], default='all',
+                        help='Dataset to export (default: all)')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet', 'arrow'], default='csv',
+                        help='Output format (default: csv)')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'],
+                        help='Compress the output (zstd requires the zstandard package)')
+    parser.add_argument('--output-dir', default=EXPORT_DIR,
+                        help=f'Output directory (default: {EXPORT_DIR})')
+
+    args = parser.parse_args()
+
+    datasets = list(DATASETS) if args.dataset == 'all' else [args.dataset]
+    print(f"Exporting {', '.join(datasets)} as {args.format}...")
+
+    for dataset in datasets:
+        export_dataset(dataset, args.format, args.compression, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Asynchronous label image download engine
+Resolves RegisterViewMark pages and streams ViewmarkDownload images to disk
+with bounded concurrency, using the PesticideSplitter session
+"""
+
+import asyncio
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+
+IMAGE_JOB_KIND = 'label_image'
+MANIFEST_COLUMNS = ['permit_number', 'label_image_url', 'local_image_path', 'status', 'completed_time']
+
+# Longest sleep while waiting for backed-off retries or jobs leased by other workers
+DRAIN_POLL_SECONDS = 1
+
+
+class AsyncImageDownloader:
+    def __init__(self, splitter, concurrency=4):
+        self.splitter = splitter
+        self.concurrency = max(1, concurrency)
+
+        # Make sure the connection pool can hold one connection per worker
+        self.splitter.http.ensure_pool(self.concurrency)
+
+    async def download_one(self, registration, pest_code, pest_name, download_date, run=asyncio.to_thread):
+        """Resolve and download one label image on the caller's event loop, returns its path or None
+
+        run(func, *args) executes each blocking step; a caller with its own
+        scheduler passes a coroutine function that applies its limits.
+        """
+        try:
+            image_url = await run(self.splitter.get_image_download_url, registration.regtid, registration.regtno)
+            registration.label_image_url = image_url
+            if not image_url:
+                return None
+            return await run(
+                self.splitter.download_pesticide_image,
+                image_url,
+                pest_code,
+                pest_name,
+                registration.permit_number,
+                download_date
+            )
+        except Exception as e:
+            print(f"      Error downloading image for {registration.permit_number}: {e}")
+            return None
+
+    async def _resolve_worker(self, resolve_queue, download_queue):
+        """Resolve view pages into image download URLs and hand them to the download stage"""
+        while True:
+            registration = await resolve_queue.get()
+            try:
+                image_url = await asyncio.to_thread(
+                    self.splitter.get_image_download_url,
+                    registration.regtid,
+                    registration.regtno
+                )
+                registration.label_image_url = image_url
+                if image_url:
+                    await download_queue.put((registration, image_url))
+            except Exception as e:
+                print(f"      Error resolving image for {registration.permit_number}: {e}")
+            finally:
+                resolve_queue.task_done()
+
+    async def _download_worker(self, download_queue, results, pest_code, pest_name, download_date):
+        """Stream resolved images to disk"""
+        while True:
+            registration, image_url = await download_queue.get()
+            try:
+                image_path = await asyncio.to_thread(
+                    self.splitter.download_pesticide_image,
+                    image_url,
+                    pest_code,
+                    pest_name,
+                    registration.permit_number,
+                    download_date
+                )
+                if image_path:
+                    results[registration.permit_number] = image_path
+            except Exception as e:
+                print(f"      Error downloading image for {registration.permit_number}: {e}")
+            finally:
+                download_queue.task_done()
+
+    async def _run(self, registrations, pest_code, pest_name, download_date):
+        """Run the resolve and download stages as a pipeline"""
+        resolve_queue = asyncio.Queue()
+        download_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results = {}
+
+        for registration in registrations:
+            if registration.regtid and registration.regtno:
+                resolve_queue.put_nowait(registration)
+
+        workers = []
+        for _ in range(self.concurrency):
+            workers.append(asyncio.create_task(self._resolve_worker(resolve_queue, download_queue)))
+            workers.append(asyncio.create_task(
+                self._download_worker(download_queue, results, pest_code, pest_name, download_date)
+            ))
+
+        # Wait for both stages to drain, then stop the workers
+        await resolve_queue.join()
+        await download_queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        return results
+
+    def download_all(self, registrations, pest_code, pest_name, download_date):
+        """Download label images for all registrations, returns {permit_number: image path | date}"""
+        if not registrations:
+            return {}
+
+        return asyncio.run(self._run(registrations, pest_code, pest_name, download_date))
+
+
+class ImageQueueConsumer:
+    """Drain label image jobs from a persistent queue and record results in sidecar manifests"""
+
+    def __init__(self, splitter, job_queue, concurrency=4):
+        self.splitter = splitter
+        self.job_queue = job_queue
+        self.concurrency = max(1, concurrency)
+        self.manifest_lock = threading.Lock()
+        self.splitter.http.ensure_pool(self.concurrency)
+
+    def write_manifest_row(self, manifest_path, row):
+        """Append one completed job to the pesticide's label manifest"""
+        with self.manifest_lock:
+            new_file = not os.path.exists(manifest_path)
+            with open(manifest_path, 'a', newline='', encoding='utf-8-sig' if new_file else 'utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=MANIFEST_COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def process_job(self, job):
+        """Resolve and download one label image, returns the manifest row"""
+        image_url = self.splitter.get_image_download_url(job['regtid'], job['regtno'])
+        image_path = None
+        if image_url:
+            image_path = self.splitter.download_pesticide_image(
+                image_url,
+                job['pest_code'],
+                job['pest_name'],
+                job['permit_number'],
+                job['download_date']
+            )
+
+        # A resolved URL that fails to download is retried; a label with no image is recorded as missing
+        if image_url and not image_path:
+            raise RuntimeError(f"download failed for {job['permit_number']}")
+
+        row = {
+            'permit_number': job['permit_number'],
+            'label_image_url': image_url or '',
+            'local_image_path': image_path or '',
+            'status': 'downloaded' if image_path else 'missing',
+            'completed_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+        self.write_manifest_row(job['manifest_path'], row)
+        return row
+
+    async def _worker(self, stats):
+        """Lease jobs until no pending or leased jobs are left"""
+        while True:
+            leased = await asyncio.to_thread(self.job_queue.lease, IMAGE_JOB_KIND)
+            if leased is None:
+                # Retries wait out their backoff and leased jobs may still fail back to pending
+                next_available = await asyncio.to_thread(self.job_queue.next_available, IMAGE_JOB_KIND)
+                if next_available is None:
+                    return
+                await asyncio.sleep(min(max(next_available - time.time(), 0.1), DRAIN_POLL_SECONDS))
+                continue
+
+            job_id, lease_token, job = leased
+            try:
+                row = await asyncio.to_thread(self.process_job, job)
+                if await asyncio.to_thread(self.job_queue.complete, job_id, lease_token, row):
+                    stats['done'] += 1
+            except Exception as e:
+                print(f"      Image job {job.get('permit_number')} failed: {e}")
+                await asyncio.to_thread(self.job_queue.fail, job_id, lease_token, e)
+                stats['failed'] += 1
+
+    async def _run(self):
+        stats = {'done': 0, 'failed': 0}
+        await asyncio.gather(*(self._worker(stats) for _ in range(self.concurrency)))
+        return stats
+
+    def drain(self):
+        """Process queued image jobs until all are done or failed for good, returns {'done': n, 'failed': n}
+
+        'failed' counts failed attempts, including ones that were retried later.
+        """
+        return asyncio.run(self._run())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Persistent job queues
+Jobs are leased by workers with a timeout, completed or failed, and survive restarts.
+Every lease carries a token, so only the worker currently holding a job can
+extend, complete or fail it
+"""
+
+import json
+import os
+import pathlib
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+
+class JobQueue:
+    """Interface for work-queue backends shared by all workers"""
+
+    def enqueue(self, kind, job_key, payload):
+        """Add a job, or reset an existing job with the same key back to pending"""
+        raise NotImplementedError
+
+    def lease(self, kind):
+        """Lease the next available job, returns (job_id, lease_token, payload) or None"""
+        raise NotImplementedError
+
+    def extend_lease(self, job_id, lease_token):
+        """Keep a long-running job leased by the current worker, returns False once the lease is lost"""
+        raise NotImplementedError
+
+    def complete(self, job_id, lease_token, result=None):
+        """Mark a leased job as done, returns False when the lease was lost to another worker"""
+        raise NotImplementedError
+
+    def fail(self, job_id, lease_token, error=''):
+        """Return a failed job to the queue after a backoff, or mark it failed after max_attempts"""
+        raise NotImplementedError
+
+    def requeue_failed(self, kind):
+        """Move failed jobs back to pending, returns the number requeued"""
+        raise NotImplementedError
+
+    def next_available(self, kind):
+        """Earliest time a pending or leased job can be leased, or None when no such jobs are left"""
+        raise NotImplementedError
+
+    def counts(self, kind):
+        """Return job counts by status"""
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    """Queue in one SQLite file, shared by any number of worker processes on the same host
+
+    The file is opened in WAL mode, which relies on shared memory between the
+    processes, so it must live on a local disk and not on a network share.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3, retry_backoff=30):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff  # seconds before the first retry, doubled per attempt
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    job_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    lease_token TEXT,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    result TEXT,
+                    updated_at REAL NOT NULL,
+                    UNIQUE (kind, job_key)
+                )
+            """)
+            # Queues created before lease tokens and retry backoff existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'lease_token' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+            if 'available_at' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (kind, status, lease_until)")
+
+    def _connect(self):
+        """Open a new connection (one per call so the queue is safe across threads and processes)"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def enqueue(self, kind, job_key, payload):
+        """Add a job, or reset an existing job with the same key back to pending"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                INSERT INTO jobs (kind, job_key, payload, status, attempts, lease_until, available_at, updated_at)
+                VALUES (?, ?, ?, 'pending', 0, 0, 0, ?)
+                ON CONFLICT (kind, job_key) DO UPDATE SET
+                    payload = excluded.payload,
+                    status = 'pending',
+                    attempts = 0,
+                    lease_until = 0,
+                    lease_token = NULL,
+                    available_at = 0,
+                    result = NULL,
+                    updated_at = excluded.updated_at
+            """, (kind, job_key, json.dumps(payload, ensure_ascii=False), now))
+
+    def lease(self, kind):
+        """Lease the next pending (or expired) job, returns (job_id, lease_token, payload) or None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # An expired lease counts as a used attempt; stop retrying jobs that keep timing out
+            conn.execute("""
+                UPDATE jobs SET status = 'failed', lease_token = NULL, lease_until = 0, result = ?, updated_at = ?
+                WHERE kind = ? AND status = 'leased' AND lease_until < ? AND attempts >= ?
+            """, (json.dumps({'error': 'lease expired'}), now, kind, now, self.max_attempts))
+            row = conn.execute("""
+                SELECT id, payload FROM jobs
+                WHERE kind = ?
+                  AND ((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_until < ?))
+                ORDER BY id
+                LIMIT 1
+            """, (kind, now, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            lease_token = uuid.uuid4().hex
+            conn.execute("""
+                UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_until = ?, lease_token = ?,
+                    updated_at = ?
+                WHERE id = ?
+            """, (now + self.lease_seconds, lease_token, now, row[0]))
+            conn.execute("COMMIT")
+            return row[0], lease_token, json.loads(row[1])
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def extend_lease(self, job_id, lease_token):
+        """Push the lease deadline of a running job forward, returns False once the lease is lost"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'leased' AND lease_token = ?",
+                (now + self.lease_seconds, now, job_id, lease_token)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, lease_token, result=None):
+        """Mark a leased job as done, returns False when the lease was lost to another worker"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET status = 'done', result = ?, lease_until = 0, lease_token = NULL, updated_at = ?
+                WHERE id = ? AND status = 'leased' AND lease_token = ?
+            """, (json.dumps(result, ensure_ascii=False), time.time(), job_id, lease_token))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, lease_token, error=''):
+        """Return a failed job to the queue after an exponential backoff, or mark it failed after max_attempts"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET
+                    status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    available_at = ? + ? * (1 << MAX(attempts - 1, 0)),
+                    result = ?, lease_until = 0, lease_token = NULL, updated_at = ?
+                WHERE id = ? AND status = 'leased' AND lease_token = ?
+            """, (self.max_attempts, now, self.retry_backoff,
+                  json.dumps({'error': str(error)}, ensure_ascii=False), now, job_id, lease_token))
+            return cursor.rowcount == 1
+
+    def requeue_failed(self, kind):
+        """Move failed jobs back to pending with a fresh attempt count"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                "WHERE kind = ? AND status = 'failed'",
+                (time.time(), kind)
+            )
+            return cursor.rowcount
+
+    def next_available(self, kind):
+        """Earliest time a pending or leased job can be leased, or None when no such jobs are left"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("""
+                SELECT MIN(CASE WHEN status = 'pending' THEN available_at ELSE lease_until END)
+                FROM jobs WHERE kind = ? AND status IN ('pending', 'leased')
+            """, (kind,)).fetchone()
+        return row[0]
+
+    def counts(self, kind):
+        """Return job counts by status"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE kind = ? GROUP BY status", (kind,)
+            ).fetchall()
+        return dict(rows)
+
+
+def read_job_counts(db_path, kind):
+    """Job counts by status without creating or migrating the queue file, for dry runs"""
+    if not os.path.exists(db_path):
+        return {}
+    uri = f"{pathlib.Path(db_path).resolve().as_uri()}?mode=ro"
+    with closing(sqlite3.connect(uri, uri=True, timeout=30)) as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs WHERE kind = ? GROUP BY status", (kind,)).fetchall()
+    return dict(rows)
+
+
+def open_job_queue(location, lease_seconds=300, max_attempts=3, retry_backoff=30):
+    """Open a queue backend from a location such as 'sqlite:///data/state/work.sqlite' or a plain file path"""
+    if location.startswith('sqlite:///'):
+        return SQLiteJobQueue(location[len('sqlite:///'):], lease_seconds, max_attempts, retry_backoff)
+    if '://' in location:
+        raise ValueError(f"Unsupported job queue backend: {location}")
+    return SQLiteJobQueue(location, lease_seconds, max_attempts, retry_backoff)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Label image integrity manifest and derivatives
+Scans every data/pesticides/*/labels/ folder in a process pool, validates
+image headers and trailers, records size, dimensions and hash in a
+per-folder manifest, renders thumbnail and web-sized copies for new or
+changed images, and puts corrupt downloads back on the image queue
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data_layout import DERIVATIVE_SIZES, MANIFEST_NAME, derivative_path
+from image_downloader import IMAGE_JOB_KIND
+from job_queue import SQLiteJobQueue
+from scraper_core import pesticide_file, write_json_atomic
+
+DERIVATIVE_QUALITY = 85
+
+# Formats the label server is known to return, by leading magic bytes
+MAGIC_BYTES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'%PDF', 'pdf'),
+]
+
+
+def sniff_format(data):
+    for magic, image_format in MAGIC_BYTES:
+        if data.startswith(magic):
+            return image_format
+    return None
+
+
+def looks_like_html(data):
+    head = data[:512].lstrip().lower()
+    return head.startswith(b'<') or b'<html' in head or b'<!doctype' in head
+
+
+def is_complete(image_format, data):
+    """Check the format's end marker, which a cut-off download is missing"""
+    tail = data[-1024:].rstrip(b'\x00\r\n ')
+    if image_format == 'jpeg':
+        return tail.endswith(b'\xff\xd9')
+    if image_format == 'png':
+        return b'IEND' in tail[-12:]
+    if image_format == 'gif':
+        return tail.endswith(b';')
+    if image_format == 'bmp':
+        return len(data) >= 6 and len(data) >= struct.unpack('<I', data[2:6])[0]
+    if image_format == 'pdf':
+        return b'%%EOF' in tail
+    return True
+
+
+def jpeg_size(data):
+    """Width and height from the first start-of-frame marker"""
+    position = 2
+    while position + 9 < len(data):
+        if data[position] != 0xFF:
+            position += 1
+            continue
+        marker = data[position + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            position += 1 if marker == 0xFF else 2
+            continue
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    return None, None
+
+
+def image_size(image_format, data):
+    """(width, height) read from the header, (None, None) when not available"""
+    try:
+        if image_format == 'jpeg':
+            return jpeg_size(data)
+        if image_format == 'png':
+            return struct.unpack('>II', data[16:24])
+        if image_format == 'gif':
+            return struct.unpack('<HH', data[6:10])
+        if image_format == 'bmp':
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+    except struct.error:
+        pass
+    return None, None
+
+
+def inspect_image(data):
+    """Validate one downloaded body, returns the manifest fields describing it"""
+    info = {'status': 'ok', 'format': None, 'width': None, 'height': None}
+    if not data:
+        info['status'] = 'empty'
+        return info
+
+    info['format'] = sniff_format(data)
+    if info['format'] is None:
+        info['status'] = 'html' if looks_like_html(data) else 'unknown_format'
+        return info
+    if not is_complete(info['format'], data):
+        info['status'] = 'truncated'
+        return info
+
+    info['width'], info['height'] = image_size(info['format'], data)
+    if info['format'] != 'pdf' and not (info['width'] and info['height']):
+        info['status'] = 'bad_header'
+    return info
+
+
+def render_derivatives(file_path, paths):
+    """Write downscaled JPEG copies with Pillow, returns the paths written"""
+    from PIL import Image
+
+    written = {}
+    with Image.open(file_path) as image:
+        image = image.convert('RGB')
+        for name, path in paths.items():
+            copy = image.copy()
+            copy.thumbnail((DERIVATIVE_SIZES[name], DERIVATIVE_SIZES[name]))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.part"
+            copy.save(temp_path, 'JPEG', quality=DERIVATIVE_QUALITY, optimize=True)
+            os.replace(temp_path, path)
+            written[name] = os.path.relpath(path, os.path.dirname(file_path))
+    return written
+
+
+def load_manifest(labels_dir):
+    path = os.path.join(labels_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}  # Rebuilt from scratch below
+
+
+def save_manifest(labels_dir, manifest):
+    """Write atomically so an interrupted scan never leaves a truncated manifest"""
+    write_json_atomic(os.path.join(labels_dir, MANIFEST_NAME), manifest, indent=1, sort_keys=True)
+
+
+def scan_labels_dir(labels_dir, derivatives=True, force=False):
+    """Check one labels folder and refresh its manifest, returns per-folder stats"""
+    manifest = load_manifest(labels_dir)
+    stats = {'labels_dir': labels_dir, 'files': 0, 'checked': 0, 'derived': 0, 'corrupt': []}
+    current = {}
+
+    for entry in os.scandir(labels_dir):
+        if not entry.is_file() or entry.name == MANIFEST_NAME or entry.name.endswith(('.part', '.tmp')):
+            continue
+        stats['files'] += 1
+        stat = entry.stat()
+        record = manifest.get(entry.name)
+        paths = {size: derivative_path(entry.path, size) for size in DERIVATIVE_SIZES}
+
+        # Unchanged since the last scan: reuse the stored hash and checks
+        unchanged = (not force and record and record['size'] == stat.st_size
+                     and record['mtime_ns'] == stat.st_mtime_ns)
+        if not unchanged:
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            record = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': hashlib.sha256(data).hexdigest(),
+                **inspect_image(data),
+                'derivatives': {},
+                'checked_at': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            stats['checked'] += 1
+
+        if record['status'] != 'ok':
+            stats['corrupt'].append(entry.name)
+        elif derivatives and record['format'] != 'pdf':
+            missing = not all(os.path.exists(path) for path in paths.values())
+            if not unchanged or missing or set(record['derivatives']) != set(paths):
+                try:
+                    record['derivatives'] = render_derivatives(entry.path, paths)
+                    stats['derived'] += 1
+                except Exception as e:
+                    print(f"  Error rendering derivatives for {entry.path}: {e}")
+        current[entry.name] = record
+
+    save_manifest(labels_dir, current)
+    return stats
+
+
+def image_file_names(local_image_paths):
+    """File names from local_image_path values stored as '/absolute/path | download date'"""
+    return local_image_paths.str.split(' | ', regex=False).str[0].map(os.path.basename)
+
+
+def registrations_by_image(pest_dir):
+    """Permit, pesticide code and name of one pesticide's labels, keyed by label file name
+
+    Labels saved during the crawl are listed in the registration CSV; labels
+    downloaded later by the image queue only in the [CODE_NAME]_labels.csv sidecar.
+    """
+    registrations = {}  # permit number -> registration row
+    rows = {}
+    sidecar_rows = []
+    for csv_path in glob.glob(os.path.join(pest_dir, '*.csv')):
+        if csv_path.endswith('_usage_range.csv'):
+            continue
+        df = pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        if csv_path.endswith('_labels.csv'):
+            sidecar_rows.append(df)
+        elif 'local_image_path' in df:
+            records = df.to_dict('records')
+            registrations.update(zip(df['permit_number'], records))
+            rows.update((file_name, record)
+                        for file_name, record in zip(image_file_names(df['local_image_path']), records)
+                        if record['local_image_path'])
+
+    # Pesticide identity for permits missing from the registration CSV, from the folder name
+    pest_code, _, pest_name = os.path.basename(os.path.normpath(pest_dir)).partition('_')
+    for df in sidecar_rows:
+        if 'local_image_path' not in df:
+            continue
+        # Later sidecar rows are newer downloads of the same permit
+        df = df[df['local_image_path'] != '']
+        for file_name, permit_number in zip(image_file_names(df['local_image_path']), df['permit_number']):
+            rows[file_name] = registrations.get(permit_number) or {
+                'permit_number': permit_number,
+                'pesticide_code': pest_code,
+                'pesticide_name': pest_name
+            }
+    return rows
+
+
+def requeue_corrupt(job_queue, labels_dir, file_names):
+    """Put corrupt labels back on the image queue, returns the number of jobs queued"""
+    from split_pesticides_with_images import permit_ids
+
+    registrations = registrations_by_image(os.path.dirname(labels_dir))
+    queued = 0
+    for file_name in file_names:
+        row = registrations.get(file_name)
+        if row is None:
+            print(f"  No registration found for {os.path.join(labels_dir, file_name)}, not re-queued")
+            continue
+
+        regtid, regtno = permit_ids(row['permit_number'])
+        job_queue.enqueue(IMAGE_JOB_KIND, row['permit_number'], {
+            'regtid': regtid,
+            'regtno': regtno,
+            'permit_number': row['permit_number'],
+            'pest_code': row['pesticide_code'],
+            'pest_name': row['pesticide_name'],
+            'download_date': time.strftime('%Y-%m-%d'),
+            'manifest_path': pesticide_file(row['pesticide_code'], row['pesticide_name'], '_labels')
+        })
+        queued += 1
+    return queued
+
+
+def scan_all(data_dir='data', workers=None, derivatives=True, force=False, job_queue=None):
+    """Scan every labels folder in a process pool, returns overall stats"""
+    labels_dirs = sorted(glob.glob(os.path.join(data_dir, 'pesticides', '*', 'labels')))
+    totals = {'folders': len(labels_dirs), 'files': 0, 'checked': 0, 'derived': 0, 'corrupt': 0, 'requeued': 0}
+    if not labels_dirs:
+        return totals
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scan_labels_dir, labels_dir, derivatives, force): labels_dir
+                   for labels_dir in labels_dirs}
+        for future in as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"  Error scanning {futures[future]}: {e}")
+                continue
+            for key in ('files', 'checked', 'derived'):
+                totals[key] += stats[key]
+            totals['corrupt'] += len(stats['corrupt'])
+            for file_name in stats['corrupt']:
+                print(f"  Corrupt label: {os.path.join(stats['labels_dir'], file_name)}")
+            if job_queue is not None and stats['corrupt']:
+                totals['requeued'] += requeue_corrupt(job_queue, stats['labels_dir'], stats['corrupt'])
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify downloaded label images and build thumbnails')
+    parser.add_argument('--data-dir', default='data',
+                        help='Root of the scraped data tree (default: data)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--no-derivatives', action='store_true',
+                        help='Only validate images; do not render thumbnails or web-size copies')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-check every file, even those unchanged since the last scan')
+    parser.add_argument('--no-requeue', action='store_true',
+                        help='Report corrupt labels without queueing re-downloads on the image queue')
+
+    args = parser.parse_args()
+
+    derivatives = not args.no_derivatives
+    if derivatives and importlib.util.find_spec('PIL') is None:
+        print("Pillow is not installed; skipping derivatives (pip install Pillow)")
+        derivatives = False
+
+    job_queue = None
+    if not args.no_requeue:
+        from split_pesticides_with_images import IMAGE_QUEUE_PATH
+        job_queue = SQLiteJobQueue(IMAGE_QUEUE_PATH)
+    totals = scan_all(args.data_dir, args.workers, derivatives, args.force, job_queue)
+
+    print(f"\n=== Label Integrity ===")
+    print(f"Folders: {totals['folders']}")
+    print(f"Files: {totals['files']} ({totals['checked']} new or changed)")
+    print(f"Derivatives rendered: {totals['derived']}")
+    print(f"Corrupt: {totals['corrupt']}")
+    if job_queue is not None:
+        print(f"Re-queued for download: {totals['requeued']} (run split_pesticides_with_images.py --drain-images)")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,6 @@ New fetcher for the PPM system at otserv2.acri.gov.tw
 This script extracts crop pesticide data from the new Taiwan government website
 """
 
-import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import re
@@ -12,37 +11,100 @@ import argparse
 import os
 import time
 import glob
+import threading
 from datetime import datetime
 from io import StringIO
 
+from crop_catalogue import CropCatalogue, crop_id_from_url, table_hash
+from numeric_fields import add_numeric_columns, ppm_numeric_fields
+from page_archive import PageArchive
+from records import CropUsage, constant_column
+from run_planner import plan_crop_run, saved_crop_page
+from data_layout import STATE_DIR, USAGE_DIR
+from scraper_core import HttpClient, aspnet_state, crop_usage_path, safe_name, write_csv
+
+SESSION_STATE_PATH = os.path.join(STATE_DIR, 'ppm_session.json')
+SESSION_MAX_AGE = 15 * 60  # Stay under the default 20 minute ASP.NET session timeout
+
 class PPMDataFetcher:
-    def __init__(self):
-        self.session = requests.Session()
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8'
-        }
-        self.session.headers.update(self.headers)
+    def __init__(self, http=None, catalogue=None, session_path=SESSION_STATE_PATH, session_max_age=SESSION_MAX_AGE,
+                 rewrite_unchanged=False):
+        self.http = http or HttpClient()
+        self.session = self.http.session
+        self.headers = self.http.headers
         self.base_url = "https://otserv2.acri.gov.tw/PPM"
+        self.catalogue = catalogue or CropCatalogue()
+        self.fetched_crops = {}  # crop id -> records saved, for crops fetched in this run
+        self.fetched_lock = threading.Lock()
+        self.session_path = session_path
+        self.session_max_age = session_max_age
+        self.session_lock = threading.Lock()
+        self.session_generation = 0
+        self.crop_page_html = None  # PLC02 page from the handshake, reused by get_crop_list
+        self.aspnet_state = {}
+        self.rewrite_unchanged = rewrite_unchanged  # Write crop files even when the table hash matches
+        
+    def reusable_session(self):
+        """State of the saved session when it is fresh and holds the crop page, else None (loads its cookies)"""
+        if not self.session_path:
+            return None
+        state = self.http.restore_session(self.session_path, self.session_max_age)
+        return state if state and state.get('crop_page_html') else None
+    
+    def establish_session(self, force=False):
+        """Establish session and access the system, reusing a saved session when it is still fresh"""
+        state = None if force else self.reusable_session()
+        if state:
+            self.crop_page_html = state['crop_page_html']
+            self.aspnet_state = state.get('aspnet_state', {})
+            print("Reusing saved session")
+            return
         
-    def establish_session(self):
-        """Establish session and access the system"""
         print("Establishing session...")
         
         # Access the system with full functionality
-        self.session.get(f"{self.base_url}/Index.aspx")
-        self.session.get(f"{self.base_url}/Menu.aspx?ASParam=JTdkWFBYJTE0JTE4NjZpdA==")
-        self.session.get(f"{self.base_url}/PLC02.aspx")
+        self.http.get(f"{self.base_url}/Index.aspx")
+        self.http.get(f"{self.base_url}/Menu.aspx?ASParam=JTdkWFBYJTE0JTE4NjZpdA==")
+        response = self.http.get(f"{self.base_url}/PLC02.aspx")
+        
+        self.crop_page_html = response.text
+        self.aspnet_state = aspnet_state(response.text)
+        if self.session_path:
+            self.http.save_session(self.session_path, crop_page_html=self.crop_page_html, aspnet_state=self.aspnet_state)
         
         print("Session established")
     
+    def is_session_expired(self, response):
+        """The site answers an expired session by bouncing back to the entry pages"""
+        final_url = getattr(response, 'url', '') or ''
+        return response.status_code in (401, 403, 440) or any(
+            page in final_url for page in ('Index.aspx', 'Login', 'Error.aspx')
+        )
+    
+    def renew_session(self, generation):
+        """Re-establish the session once, even when several threads notice the expiry together"""
+        with self.session_lock:
+            if self.session_generation == generation:
+                print("Session expired, re-establishing...")
+                self.session.cookies.clear()
+                self.establish_session(force=True)
+                self.session_generation += 1
+    
+    def get_page(self, url):
+        """GET a page inside the session, re-establishing it transparently if it has expired"""
+        generation = self.session_generation
+        response = self.http.get(url)
+        if self.is_session_expired(response):
+            self.renew_session(generation)
+            response = self.http.get(url)
+        return response
+    
     def get_existing_crops(self, base_filename):
         """Get list of crops that already have data files"""
         existing_crops = set()
         
         # Check data/usage/ folder for existing files
-        pattern = f"data/usage/*_{base_filename}"
+        pattern = os.path.join(USAGE_DIR, f"*_{base_filename}")
         existing_files = glob.glob(pattern)
         
         for file_path in existing_files:
@@ -59,11 +121,13 @@ class PPMDataFetcher:
         """Extract the crop list and their URLs"""
         print("Fetching crop list...")
         
-        response = self.session.get(f"{self.base_url}/PLC02.aspx")
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # The handshake already loaded PLC02, only fetch it again without one
+        if self.crop_page_html is None:
+            self.crop_page_html = self.get_page(f"{self.base_url}/PLC02.aspx").text
+        soup = BeautifulSoup(self.crop_page_html, 'html.parser')
         
-        # Find all crop links
-        crop_links = []
+        # Find all crop links, keyed by ASParam so nested div/a matches collapse into one entry
+        crop_links = {}
         for link in soup.find_all(['div', 'a'], onclick=True):
             onclick = link.get('onclick', '')
             if 'PLC0101.aspx?ASParam=' in onclick:
@@ -73,24 +137,29 @@ class PPMDataFetcher:
                     url = url_match.group(1)
                     # Get the crop name from the text
                     crop_name = link.text.strip()
-                    if crop_name:
-                        crop_links.append({
+                    crop_id = crop_id_from_url(url)
+                    if crop_name and crop_id not in crop_links:
+                        crop_links[crop_id] = {
+                            'id': crop_id,
                             'name': crop_name,
                             'url': f"{self.base_url}/{url}"
-                        })
+                        }
         
         print(f"Found {len(crop_links)} crop entries")
-        return crop_links
+        return list(crop_links.values())
+    
+    def is_crop_saved(self, crop, base_filename, existing_crops):
+        """True when a crop already has an output file, by catalogue id or (for older runs) by file name"""
+        if self.catalogue.get(crop['id']):
+            return self.catalogue.has_output(crop['id'], base_filename)
+        return safe_name(crop['name']) in existing_crops
     
     def parse_table_with_tolerance(self, soup):
-        """Parse table data including hidden tolerance columns"""
-        all_data = []
+        """Parse table data including hidden tolerance columns, returns a DataFrame"""
+        all_data = pd.DataFrame()
         
         # Use pandas to get the main pesticide table structure, then enhance with tolerance data
         try:
-            import pandas as pd
-            from io import StringIO
-            
             # Get the table structure using pandas
             dfs = pd.read_html(StringIO(str(soup)))
             pesticide_df = None
@@ -126,36 +195,33 @@ class PPMDataFetcher:
                 tolerance_text = cell.get_text(strip=True)
                 
                 # Extract row number from ID like "Tolerance_td39"
-                import re
                 match = re.search(r'tolerance_td(\d+)', cell_id.lower())
                 if match:
                     row_num = int(match.group(1))
                     tolerance_data[row_num] = tolerance_text
             
-            # Convert pandas DataFrame to list of dictionaries and add tolerance data
-            for i, (idx, row) in enumerate(pesticide_df.iterrows()):
-                row_dict = row.to_dict()
-                
-                # Try to find corresponding tolerance data
-                # The tolerance row numbers seem to start from a base number
-                tolerance_text = ""
-                for tolerance_row_num, tolerance_value in tolerance_data.items():
-                    # Try different mapping strategies
-                    if tolerance_row_num - 38 == i:  # Adjust base offset as needed
-                        tolerance_text = tolerance_value
-                        break
-                    elif tolerance_row_num - 39 == i:
-                        tolerance_text = tolerance_value
-                        break
-                    elif tolerance_row_num - len(tolerance_data) + len(pesticide_df) == i:
-                        tolerance_text = tolerance_value
-                        break
-                
-                row_dict[tolerance_column_name] = tolerance_text
-                all_data.append(row_dict)
+            # Map tolerance cells onto table rows and add them as one column
+            # The tolerance row numbers seem to start from a base number, so try
+            # different offsets; the first tolerance cell matching a row wins
+            row_count = len(pesticide_df)
+            tolerance_column = [""] * row_count
+            assigned = [False] * row_count
+            for tolerance_row_num, tolerance_value in tolerance_data.items():
+                candidates = (
+                    tolerance_row_num - 38,  # Adjust base offset as needed
+                    tolerance_row_num - 39,
+                    tolerance_row_num - len(tolerance_data) + row_count
+                )
+                for i in candidates:
+                    if 0 <= i < row_count and not assigned[i]:
+                        tolerance_column[i] = tolerance_value
+                        assigned[i] = True
+            
+            all_data = pesticide_df.copy()
+            all_data[tolerance_column_name] = tolerance_column
             
             if tolerance_data:
-                print(f"    Successfully added tolerance data to {len([r for r in all_data if r.get(tolerance_column_name)])} rows")
+                print(f"    Successfully added tolerance data to {sum(1 for value in tolerance_column if value)} rows")
             
             return all_data
             
@@ -163,12 +229,61 @@ class PPMDataFetcher:
             print(f"    Error in enhanced parsing: {e}")
             return all_data
     
-    def fetch_crop_pesticides(self, crop_url, crop_name, base_filename):
+    def add_crop_metadata(self, df, crop_usage):
+        """Add crop name, source URL and fetch time as constant columns, plus parsed numeric columns"""
+        df['作物名稱'] = constant_column(crop_usage.crop_name, len(df))
+        df['資料來源URL'] = constant_column(crop_usage.source_url, len(df))
+        df['擷取時間'] = constant_column(crop_usage.fetch_time, len(df))
+        add_numeric_columns(df, ppm_numeric_fields(df.columns))
+    
+    def save_crop_table(self, df, crop_id, crop_name, crop_url, base_filename):
+        """Add metadata and save a crop table, skipping the write when its content is unchanged"""
+        filename = self.catalogue.output_path(crop_id, crop_name, base_filename)
+        content_hash = table_hash(df)
+        if not self.rewrite_unchanged and self.catalogue.is_unchanged(crop_id, content_hash, filename):
+            print(f"    Unchanged since last run, keeping {filename}")
+            self.catalogue.record(crop_id, crop_name, crop_url, filename, content_hash, len(df))
+            return len(df)
+        
+        # Add metadata
+        self.add_crop_metadata(df, CropUsage(crop_name, crop_url, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        
+        # Save immediately to usage folder
+        write_csv(df, filename)
+        self.catalogue.record(crop_id, crop_name, crop_url, filename, content_hash, len(df))
+        print(f"    Saved {len(df)} records to {filename}")
+        
+        return len(df)
+    
+    def fetch_crop_pesticides(self, crop_url, crop_name, base_filename, crop_id=None):
         """Fetch pesticide data for a specific crop and save immediately"""
+        crop_id = crop_id or crop_id_from_url(crop_url) or safe_name(crop_name)
+        
+        # Never fetch the same crop page twice in one run
+        with self.fetched_lock:
+            if crop_id in self.fetched_crops:
+                print(f"  Already fetched this run: {crop_name}")
+                return self.fetched_crops[crop_id]
+            self.fetched_crops[crop_id] = 0
+        
+        records = 0
+        try:
+            records = self.fetch_crop_table(crop_url, crop_name, base_filename, crop_id)
+        finally:
+            # Only remember successful fetches so a failed crop can be retried in the same run
+            with self.fetched_lock:
+                if records > 0:
+                    self.fetched_crops[crop_id] = records
+                else:
+                    self.fetched_crops.pop(crop_id, None)
+        return records
+    
+    def fetch_crop_table(self, crop_url, crop_name, base_filename, crop_id):
+        """Fetch and save one crop page, returns the number of records saved"""
         print(f"  Fetching data for: {crop_name}")
         
         try:
-            response = self.session.get(crop_url)
+            response = self.get_page(crop_url)
             
             if response.status_code != 200:
                 print(f"    Error: HTTP {response.status_code}")
@@ -180,25 +295,9 @@ class PPMDataFetcher:
             # Try custom parsing first to get tolerance data
             custom_data = self.parse_table_with_tolerance(soup)
             
-            if custom_data:
+            if not custom_data.empty:
                 print(f"    Found {len(custom_data)} records with custom parsing")
-                
-                # Convert to DataFrame
-                df = pd.DataFrame(custom_data)
-                
-                # Add metadata
-                df['作物名稱'] = crop_name
-                df['資料來源URL'] = crop_url
-                df['擷取時間'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Save immediately to usage folder
-                os.makedirs('data/usage', exist_ok=True)
-                safe_crop_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', crop_name)
-                filename = f"data/usage/{safe_crop_name}_{base_filename}"
-                df.to_csv(filename, index=False, encoding='utf-8-sig')
-                print(f"    Saved {len(df)} records to {filename}")
-                
-                return len(df)
+                return self.save_crop_table(custom_data, crop_id, crop_name, crop_url, base_filename)
             
             # Fallback to pandas HTML parsing
             try:
@@ -209,20 +308,7 @@ class PPMDataFetcher:
                     if df.shape[0] > 1 and df.shape[1] > 3:  # Non-empty table with multiple columns
                         if any('藥劑' in str(col) for col in df.columns):
                             print(f"    Found pesticide table: {df.shape}")
-                            
-                            # Add metadata
-                            df['作物名稱'] = crop_name
-                            df['資料來源URL'] = crop_url
-                            df['擷取時間'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            # Save immediately to usage folder
-                            os.makedirs('data/usage', exist_ok=True)
-                            safe_crop_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', crop_name)
-                            filename = f"data/usage/{safe_crop_name}_{base_filename}"
-                            df.to_csv(filename, index=False, encoding='utf-8-sig')
-                            print(f"    Saved {len(df)} records to {filename}")
-                            
-                            return len(df)
+                            return self.save_crop_table(df, crop_id, crop_name, crop_url, base_filename)
                 
             except Exception as e:
                 print(f"    Error parsing tables: {e}")
@@ -241,11 +327,9 @@ class PPMDataFetcher:
         for df in all_data:
             if not df.empty and '作物名稱' in df.columns:
                 crop_name = df['作物名稱'].iloc[0]
-                # Sanitize filename
-                safe_crop_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', crop_name)
-                filename = f"data/{safe_crop_name}_{base_filename}"
+                filename = crop_usage_path(crop_name, base_filename)
                 
-                df.to_csv(filename, index=False, encoding='utf-8-sig')
+                write_csv(df, filename)
                 print(f"Saved {len(df)} records to {filename}")
                 total_records += len(df)
         
@@ -261,17 +345,36 @@ def main():
                         help='Process all crops (ignores limit)')
     parser.add_argument('--force', action='store_true',
                         help='Force re-download all crops (ignore existing files)')
+    parser.add_argument('--new-session', action='store_true',
+                        help='Ignore the saved session and perform the full handshake')
+    parser.add_argument('--archive', action='store_true',
+                        help='Archive every fetched page to data/archive for offline re-parsing')
+    parser.add_argument('--plan', action='store_true',
+                        help='Estimate requests, bytes and time for this run without fetching anything')
     
     args = parser.parse_args()
     
     # Create directories (will be handled in fetch_crop_pesticides method)
     
     # Initialize fetcher
-    fetcher = PPMDataFetcher()
-    fetcher.establish_session()
-    
-    # Get crop list
-    crop_list = fetcher.get_crop_list()
+    fetcher = PPMDataFetcher(rewrite_unchanged=args.force)
+    if args.plan:
+        # Work from the crop page saved with the last session, or the crop catalogue
+        fresh_session = not args.new_session and fetcher.reusable_session() is not None
+        fetcher.crop_page_html = saved_crop_page(fetcher.session_path)
+        if fetcher.crop_page_html:
+            crop_list = fetcher.get_crop_list()
+        else:
+            crop_list = [{'id': crop_id, 'name': entry['name'], 'url': entry['url']}
+                         for crop_id, entry in fetcher.catalogue.entries.items()]
+            print(f"Using {len(crop_list)} crops from the crop catalogue")
+    else:
+        if args.archive:
+            fetcher.http.add_response_hook(PageArchive().hook)
+        fetcher.establish_session(force=args.new_session)
+        
+        # Get crop list
+        crop_list = fetcher.get_crop_list()
     
     if not crop_list:
         print("No crops found!")
@@ -287,12 +390,7 @@ def main():
         existing_crops = fetcher.get_existing_crops(args.output)
         
         # Filter out crops that already have data
-        new_crops = []
-        for crop in crop_list:
-            # Sanitize crop name same way as in fetch_crop_pesticides
-            safe_crop_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', crop['name'])
-            if safe_crop_name not in existing_crops:
-                new_crops.append(crop)
+        new_crops = [crop for crop in crop_list if not fetcher.is_crop_saved(crop, args.output, existing_crops)]
         
         print(f"Total crops: {len(crop_list)}")
         print(f"Already processed: {len(existing_crops)}")
@@ -307,6 +405,10 @@ def main():
     else:
         print(f"Processing all {len(crops_to_process)} crops...")
     
+    if args.plan:
+        plan_crop_run(len(crops_to_process), handshake=not fresh_session).print()
+        return
+    
     # Fetch data for each crop
     success_count = 0
     total_records = 0
@@ -314,7 +416,7 @@ def main():
     for i, crop in enumerate(crops_to_process, 1):
         print(f"{i}/{len(crops_to_process)}: {crop['name']}")
         
-        records = fetcher.fetch_crop_pesticides(crop['url'], crop['name'], args.output)
+        records = fetcher.fetch_crop_pesticides(crop['url'], crop['name'], args.output, crop['id'])
         if records > 0:
             success_count += 1
             total_records += records
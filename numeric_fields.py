@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Numeric normalization of free-text quantity columns
+Extracts min/max values and units from dosage, dilution, pre-harvest
+interval, concentration and tolerance text such as '葉:0.33 公斤;穗:0.4 公斤'
+or '75.000 (%) (w/w)'. Each distinct string is parsed once per process and
+results are broadcast back over the column
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+QUANTITY_PATTERN = re.compile(
+    r'(\d+(?:,\d{3})*(?:\.\d+)?)\s*\(?\s*'
+    r'(%|ppm|公斤|公克|公升|毫升|克|倍|天|日|kg|g|L|ml|mL)?'
+)
+
+# 'a/b' or 'a:b' in a dilution column is one ratio, e.g. '1/1000' is a 1000-fold dilution
+RATIO_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*[/:：]\s*(\d+(?:,\d{3})*(?:\.\d+)?)')
+RATIO_PREFIXES = {'dilution'}
+
+# Source column -> output prefix (columns <prefix>_min, <prefix>_max, <prefix>_unit)
+USAGE_NUMERIC_FIELDS = {
+    'dosage_per_hectare': 'dosage',
+    'dilution_ratio': 'dilution',
+    'pre_harvest_interval': 'phi_days',
+}
+REGISTRATION_NUMERIC_FIELDS = {
+    'concentration': 'concentration',
+}
+
+# PPM column headers vary, so they are matched by keyword
+PPM_NUMERIC_KEYWORDS = {
+    '容許量': 'tolerance_ppm',
+    '稀釋': 'dilution',
+    '安全採收期': 'phi_days',
+}
+
+NUMERIC_PREFIXES = (set(USAGE_NUMERIC_FIELDS.values()) | set(REGISTRATION_NUMERIC_FIELDS.values())
+                    | set(PPM_NUMERIC_KEYWORDS.values()))
+NUMERIC_VALUE_COLUMNS = {f"{prefix}_{part}" for prefix in NUMERIC_PREFIXES for part in ('min', 'max')}
+NUMERIC_COLUMNS = NUMERIC_VALUE_COLUMNS | {f"{prefix}_unit" for prefix in NUMERIC_PREFIXES}
+
+
+@lru_cache(maxsize=65536)
+def parse_quantity(text, ratio=False):
+    """Return (min, max, unit) for one free-text quantity, NaN values when no number is found
+
+    Several numbers (a range such as '2-3' or '2~3', or one value per crop part)
+    give their min and max. With ratio=True each 'a/b' is a single dilution
+    factor b/a in 倍.
+    """
+    values = []
+    unit = ''
+    if ratio:
+        for numerator, denominator in RATIO_PATTERN.findall(text):
+            if float(numerator):
+                values.append(float(denominator.replace(',', '')) / float(numerator))
+                unit = '倍'
+        text = RATIO_PATTERN.sub(' ', text)
+    for number, number_unit in QUANTITY_PATTERN.findall(text):
+        values.append(float(number.replace(',', '')))
+        if number_unit and not unit:
+            unit = '日' if number_unit == '天' else number_unit
+    if not values:
+        return np.nan, np.nan, ''
+    return min(values), max(values), unit
+
+
+def normalize_column(values, ratio=False):
+    """Parse a whole column, returning (min array, max array, unit array)"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna('').astype(str))
+    parsed = [parse_quantity(text, ratio) for text in uniques]
+    mins = np.array([p[0] for p in parsed] + [np.nan], dtype='float64')
+    maxs = np.array([p[1] for p in parsed] + [np.nan], dtype='float64')
+    units = np.array([p[2] for p in parsed] + [''], dtype=object)
+    # factorize uses -1 for missing values, which indexes the trailing NaN entry
+    return mins[codes], maxs[codes], units[codes]
+
+
+def add_numeric_columns(df, fields):
+    """Add <prefix>_min/_max/_unit columns for each {source column: prefix} present in df"""
+    for column, prefix in fields.items():
+        if column not in df.columns:
+            continue
+        mins, maxs, units = normalize_column(df[column], ratio=prefix in RATIO_PREFIXES)
+        df[f"{prefix}_min"] = mins
+        df[f"{prefix}_max"] = maxs
+        df[f"{prefix}_unit"] = pd.Categorical(units)
+    return df
+
+
+def ppm_numeric_fields(columns):
+    """Map PPM table columns to numeric prefixes by keyword"""
+    fields = {}
+    for column in columns:
+        for keyword, prefix in PPM_NUMERIC_KEYWORDS.items():
+            if keyword in str(column) and prefix not in fields.values():
+                fields[column] = prefix
+                break
+    return fields
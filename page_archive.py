@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Raw page archive and offline re-parse
+Every fetched page body is appended, zlib-compressed, to segment files with
+a JSONL offset index. A replay client serves those bodies back through
+HttpClient's cache interface, so the normal parsers can rebuild all CSV
+outputs from the archive in a process pool without touching the network
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlencode, urlparse
+
+ARCHIVE_DIR = 'data/archive'
+SEGMENT_BYTES = 256 * 1024 * 1024
+
+
+def request_key(url, params=None):
+    """Canonical key for a GET request: URL plus sorted query parameters"""
+    if not params:
+        return url
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}{urlencode(sorted(params.items()))}"
+
+
+class PageArchive:
+    """Append-only compressed segments plus an offset index
+
+    Each process writes its own segment files so concurrent crawlers never
+    interleave bytes; index lines are appended with one write each.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, segment_bytes=SEGMENT_BYTES):
+        self.archive_dir = archive_dir
+        self.segment_bytes = segment_bytes
+        self.index_path = os.path.join(archive_dir, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.segment_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.segment_number = 0
+        self.segment_name = None
+        self.segment_size = 0
+
+    def _next_segment(self):
+        self.segment_number += 1
+        self.segment_name = f"{self.segment_prefix}-{self.segment_number:04d}.seg"
+        self.segment_size = 0
+
+    def append(self, key, body, status_code=200, encoding=None):
+        """Compress and append one body, returns its index entry"""
+        data = zlib.compress(body, 6)
+        with self.lock:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            if self.segment_name is None or self.segment_size + len(data) > self.segment_bytes:
+                self._next_segment()
+
+            with open(os.path.join(self.archive_dir, self.segment_name), 'ab') as f:
+                f.write(data)
+            entry = {
+                'key': key,
+                'segment': self.segment_name,
+                'offset': self.segment_size,
+                'length': len(data),
+                'status': status_code,
+                'encoding': encoding,
+                'fetched_at': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self.segment_size += len(data)
+
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return entry
+
+    def hook(self, url, params, response):
+        """HttpClient response hook archiving every successful page"""
+        if response.status_code == 200:
+            self.append(request_key(url, params), response.content, response.status_code, response.encoding)
+
+    def latest_entries(self):
+        """Index entries by key, keeping the most recent fetch of each"""
+        entries = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from an interrupted run
+                    entries[entry['key']] = entry
+        return entries
+
+    def read(self, entry):
+        """Decompressed body of one index entry"""
+        with open(os.path.join(self.archive_dir, entry['segment']), 'rb') as f:
+            f.seek(entry['offset'])
+            return zlib.decompress(f.read(entry['length']))
+
+
+class ArchivedResponse:
+    """Just enough of requests.Response for the parsers"""
+
+    def __init__(self, url, content=b'', status_code=404, encoding=None):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.encoding = encoding or 'utf-8'
+        self.headers = {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def close(self):
+        pass
+
+
+class ArchiveReplay:
+    """HttpClient cache that answers every GET from the archive (404 when never archived)"""
+
+    def __init__(self, archive, entries=None):
+        self.archive = archive
+        self.entries = entries if entries is not None else archive.latest_entries()
+
+    def get(self, url, params=None):
+        key = request_key(url, params)
+        entry = self.entries.get(key)
+        if entry is None:
+            return ArchivedResponse(key)
+        return ArchivedResponse(key, self.archive.read(entry), entry['status'], entry.get('encoding'))
+
+    def store(self, url, params, response):
+        pass
+
+
+# Per-process state for the re-parse pool
+_worker = {}
+
+
+def _init_worker(archive_dir, output_name):
+    from crop_catalogue import CropCatalogue
+    from new_fetcher import PPMDataFetcher
+    from scraper_core import HttpClient
+    from split_pesticides_with_images import PesticideSplitter
+
+    archive = PageArchive(archive_dir)
+    replay = ArchiveReplay(archive)
+    # A re-parse exists to apply parser changes, so every crop file is rewritten
+    _worker['fetcher'] = PPMDataFetcher(http=HttpClient(cache=replay, offline=True), session_path=None,
+                                        rewrite_unchanged=True)
+    _worker['catalogue'] = CropCatalogue()
+    _worker['splitter'] = PesticideSplitter(http=HttpClient(cache=replay, offline=True), usage_cache_dir=None)
+    _worker['pesticide_data'] = _worker['splitter'].load_pesticide_data()
+    _worker['output_name'] = output_name
+
+
+def _reparse_crop(crop_url, crop_id):
+    entry = _worker['catalogue'].get(crop_id)
+    if not entry:
+        return 0  # Name and output path are only known for crops saved by an earlier crawl
+    return _worker['fetcher'].fetch_crop_pesticides(crop_url, entry['name'], _worker['output_name'], crop_id)
+
+
+def _reparse_pesticide(pest_code):
+    import pandas as pd
+    from scraper_core import pesticide_file
+
+    splitter = _worker['splitter']
+    pest_data = _worker['pesticide_data'].get(pest_code)
+    if pest_data is None:
+        return 0
+    pest_name = pest_data['basic_info']['pesticide_name']
+
+    # Label images are not re-downloaded; keep the URLs and paths recorded by the crawl,
+    # including those written later by the image queue to the _labels.csv sidecar
+    known_image_paths = {}
+    known_image_urls = {}
+    for csv_path in (pesticide_file(pest_code, pest_name), pesticide_file(pest_code, pest_name, '_labels')):
+        if not os.path.exists(csv_path):
+            continue
+        existing = pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        for column, known in (('local_image_path', known_image_paths), ('label_image_url', known_image_urls)):
+            if column in existing:
+                known.update((permit, value) for permit, value in zip(existing['permit_number'], existing[column])
+                             if value)
+
+    splitter.per_permit_usage = os.path.exists(pesticide_file(pest_code, pest_name, '_permit_usage_range'))
+    result = splitter.create_pesticide_csv(pest_code, pest_data, download_images=False,
+                                           known_image_paths=known_image_paths, known_image_urls=known_image_urls)
+    splitter.create_usage_range_csv(pest_code, pest_data)
+    return result['registration_count']
+
+
+def reparse_archive(archive_dir=ARCHIVE_DIR, workers=None, output_name='pesticide_data.csv'):
+    """Rebuild crop and pesticide CSVs from the archive, returns counts per source"""
+    from crop_catalogue import crop_id_from_url
+
+    entries = PageArchive(archive_dir).latest_entries()
+    crops = {}
+    pest_codes = set()
+    for key in entries:
+        parsed = urlparse(key)
+        if parsed.path.endswith('PLC0101.aspx'):
+            crops[crop_id_from_url(key)] = key
+        elif parsed.path.endswith('/RegisterList'):
+            pest_codes.update(parse_qs(parsed.query).get('pestcd', []))
+
+    print(f"Archive holds {len(entries)} pages: {len(crops)} crop pages, {len(pest_codes)} pesticides")
+    stats = {'crops': 0, 'crop_records': 0, 'pesticides': 0, 'registrations': 0, 'errors': 0}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(archive_dir, output_name)) as executor:
+        futures = {executor.submit(_reparse_crop, url, crop_id): 'crop' for crop_id, url in crops.items()}
+        futures.update({executor.submit(_reparse_pesticide, code): 'pesticide' for code in sorted(pest_codes)})
+        for future in as_completed(futures):
+            try:
+                count = future.result()
+            except Exception as e:
+                print(f"  Error re-parsing: {e}")
+                stats['errors'] += 1
+                continue
+            if futures[future] == 'crop' and count:
+                stats['crops'] += 1
+                stats['crop_records'] += count
+            elif futures[future] == 'pesticide' and count:
+                stats['pesticides'] += 1
+                stats['registrations'] += count
+    return stats
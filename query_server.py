@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Local read-only HTTP query service over the scraped data
+Loads the pesticide list, registrations, usage ranges, PPM crop usage and
+label manifests into in-memory indexes, serves JSON and label images with
+response caching, and reloads automatically when a new scrape finishes
+"""
+
+import argparse
+import csv
+import glob
+import json
+import mimetypes
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from data_layout import CATEGORICAL_COLUMNS, DERIVATIVE_SIZES, dataset_files, derivative_path
+
+
+def read_csv_rows(file_path):
+    """Read a CSV file into a list of dicts, sharing one string object per repeated categorical value"""
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        return [
+            {k: sys.intern(v) if k in CATEGORICAL_COLUMNS and v else v for k, v in row.items()}
+            for row in csv.DictReader(f)
+        ]
+
+
+def data_fingerprint(data_dir):
+    """Cheap fingerprint of the data tree (file count and newest mtime) used for hot reload"""
+    latest = 0.0
+    count = 0
+    patterns = [
+        os.path.join(data_dir, 'pesticides', '*', '*.csv'),
+        os.path.join(data_dir, 'usage', '*.csv'),
+        os.path.join(data_dir, 'regulatory', '*.csv'),
+    ]
+    for pattern in patterns:
+        for file_path in glob.iglob(pattern):
+            count += 1
+            latest = max(latest, os.path.getmtime(file_path))
+    return count, latest
+
+
+class DataIndex:
+    """In-memory indexes over one load of the data tree"""
+
+    def __init__(self, data_dir='data'):
+        self.data_dir = data_dir
+        self.pesticides = {}            # code -> pesticide list row
+        self.registrations = {}         # permit number -> registration row
+        self.registrations_by_code = {} # code -> [permit numbers]
+        self.usage_by_crop = {}         # crop -> [usage range rows]
+        self.usage_by_permit = {}       # permit number -> [permit usage range rows]
+        self.ppm_by_crop = {}           # crop -> [PPM crop usage rows]
+        self.labels = {}                # permit number -> local image path
+        self.loaded_at = ''
+
+    @classmethod
+    def load(cls, data_dir='data'):
+        index = cls(data_dir)
+        index._load_pesticides()
+        index._load_registrations()
+        index._load_usage_ranges()
+        index._load_ppm()
+        index._load_labels()
+        index.loaded_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        return index
+
+    def _load_pesticides(self):
+        list_path = os.path.join(self.data_dir, 'regulatory', 'taiwan_pesticide_list.csv')
+        if os.path.exists(list_path):
+            for row in read_csv_rows(list_path):
+                self.pesticides[row.get('代號', '')] = row
+
+    def _load_registrations(self):
+        for file_path in dataset_files('registrations', self.data_dir):
+            for row in read_csv_rows(file_path):
+                if row.get('data_type') != 'registration':
+                    continue
+                permit_number = row.get('permit_number', '')
+                self.registrations[permit_number] = row
+                self.registrations_by_code.setdefault(row.get('pesticide_code', ''), []).append(permit_number)
+
+                # local_image_path is stored as "/absolute/path | date"
+                image_path = row.get('local_image_path', '').split(' | ')[0].strip()
+                if image_path:
+                    self.labels[permit_number] = image_path
+
+    def _load_usage_ranges(self):
+        for file_path in dataset_files('usage_ranges', self.data_dir):
+            for row in read_csv_rows(file_path):
+                self.usage_by_crop.setdefault(row.get('crop', ''), []).append(row)
+        for file_path in dataset_files('permit_usage_ranges', self.data_dir):
+            for row in read_csv_rows(file_path):
+                self.usage_by_permit.setdefault(row.get('permit_number', ''), []).append(row)
+
+    def _load_ppm(self):
+        for file_path in dataset_files('crop_usage', self.data_dir):
+            for row in read_csv_rows(file_path):
+                self.ppm_by_crop.setdefault(row.get('作物名稱', ''), []).append(row)
+
+    def _load_labels(self):
+        # Label manifests written by the background image queue override inline paths
+        for file_path in glob.glob(os.path.join(self.data_dir, 'pesticides', '*', '*_labels.csv')):
+            for row in read_csv_rows(file_path):
+                image_path = row.get('local_image_path', '').split(' | ')[0].strip()
+                if image_path:
+                    self.labels[row.get('permit_number', '')] = image_path
+
+    def stats(self):
+        return {
+            'pesticides': len(self.pesticides),
+            'registrations': len(self.registrations),
+            'usage_crops': len(self.usage_by_crop),
+            'permit_usage_permits': len(self.usage_by_permit),
+            'ppm_crops': len(self.ppm_by_crop),
+            'labels': len(self.labels),
+            'loaded_at': self.loaded_at
+        }
+
+    def products_for(self, crop, pest=None):
+        """Usage ranges for a crop (optionally one pest) with the registered products of each pesticide"""
+        usage_rows = self.usage_by_crop.get(crop, [])
+        if pest:
+            usage_rows = [row for row in usage_rows if row.get('pest_disease') == pest]
+
+        pesticide_codes = []
+        for row in usage_rows:
+            code = row.get('pesticide_code', '')
+            if code not in pesticide_codes:
+                pesticide_codes.append(code)
+
+        return {
+            'crop': crop,
+            'pest': pest,
+            'usage_ranges': usage_rows,
+            'products': {
+                code: [self.registrations[p] for p in self.registrations_by_code.get(code, [])]
+                for code in pesticide_codes
+            },
+            'ppm_usage': self.ppm_by_crop.get(crop, [])
+        }
+
+    def permit_details(self, permit_number):
+        registration = self.registrations.get(permit_number)
+        if registration is None:
+            return None
+        return {
+            'registration': registration,
+            'pesticide': self.pesticides.get(registration.get('pesticide_code', '')),
+            'usage_ranges': self.usage_by_permit.get(permit_number, []),
+            'label_available': permit_number in self.labels
+        }
+
+
+class QueryService:
+    """Holds the current index, a response cache and the hot reload thread"""
+
+    def __init__(self, data_dir='data', cache_size=1024, reload_interval=30):
+        self.data_dir = data_dir
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.fingerprint = data_fingerprint(data_dir)
+        self.pending_fingerprint = None
+        self.index = DataIndex.load(data_dir)
+        print(f"Loaded index: {self.index.stats()}")
+
+    def cached(self, key, build):
+        """Return a cached JSON body, building it on a miss"""
+        with self.cache_lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+                return body
+
+        body = json.dumps(build(), ensure_ascii=False).encode('utf-8')
+        with self.cache_lock:
+            self.cache[key] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return body
+
+    def reload_if_changed(self):
+        """Rebuild the index off to the side and swap it in when the data tree changed"""
+        fingerprint = data_fingerprint(self.data_dir)
+        if fingerprint == self.fingerprint:
+            return False
+
+        # Wait until the tree stops changing so a scrape in progress is not loaded half-written
+        if fingerprint != self.pending_fingerprint:
+            self.pending_fingerprint = fingerprint
+            return False
+
+        index = DataIndex.load(self.data_dir)
+        with self.cache_lock:
+            self.index = index
+            self.fingerprint = fingerprint
+            self.cache.clear()
+        print(f"Reloaded index: {index.stats()}")
+        return True
+
+    def watch(self):
+        """Poll for new scrape output in a background thread"""
+        def loop():
+            while True:
+                time.sleep(self.reload_interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"Error reloading data: {e}")
+
+        threading.Thread(target=loop, daemon=True).start()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None  # Set by serve()
+
+    def send_body(self, status, body, content_type='application/json; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, json.dumps({'error': message}, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        parts = [unquote(p) for p in parsed.path.strip('/').split('/') if p]
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        service = self.service
+        index = service.index
+
+        if parts == ['health']:
+            self.send_body(200, json.dumps(index.stats()).encode('utf-8'))
+        elif parts == ['products']:
+            if not query.get('crop'):
+                self.send_error_json(400, 'crop parameter is required')
+                return
+            body = service.cached((id(index), self.path), lambda: index.products_for(query['crop'], query.get('pest')))
+            self.send_body(200, body)
+        elif len(parts) == 2 and parts[0] == 'permits':
+            details = index.permit_details(parts[1])
+            if details is None:
+                self.send_error_json(404, f"permit {parts[1]} not found")
+                return
+            self.send_body(200, service.cached((id(index), self.path), lambda: details))
+        elif len(parts) == 2 and parts[0] == 'pesticides':
+            code = parts[1]
+            if code not in index.pesticides and code not in index.registrations_by_code:
+                self.send_error_json(404, f"pesticide {code} not found")
+                return
+            body = service.cached((id(index), self.path), lambda: {
+                'pesticide': index.pesticides.get(code),
+                'permits': index.registrations_by_code.get(code, [])
+            })
+            self.send_body(200, body)
+        elif len(parts) == 2 and parts[0] == 'labels':
+            image_path = index.labels.get(parts[1])
+            if not image_path or not os.path.exists(image_path):
+                self.send_error_json(404, f"no label image for {parts[1]}")
+                return
+            # Serve the cached thumbnail or web-size copy when one was rendered
+            if query.get('size') in DERIVATIVE_SIZES and os.path.exists(derivative_path(image_path, query['size'])):
+                image_path = derivative_path(image_path, query['size'])
+            with open(image_path, 'rb') as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+            self.send_body(200, body, content_type)
+        else:
+            self.send_error_json(404, 'unknown endpoint')
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet under load
+
+
+def serve(host, port, data_dir, reload_interval, cache_size):
+    service = QueryService(data_dir, cache_size, reload_interval)
+    service.watch()
+    QueryHandler.service = service
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"Serving on http://{host}:{port}/ (reload check every {reload_interval}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local read-only query server over scraped pesticide data')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on (default: 8080)')
+    parser.add_argument('--data-dir', default='data',
+                        help='Root of the scraped data tree (default: data)')
+    parser.add_argument('--reload-interval', type=int, default=30,
+                        help='Seconds between checks for new scrape output (default: 30)')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Number of cached responses (default: 1024)')
+
+    args = parser.parse_args()
+    serve(args.host, args.port, args.data_dir, args.reload_interval, args.cache_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Queue-driven scraping workers
+Enqueue PPM crop pages and APHIA pesticide codes into a shared work queue,
+then run any number of worker processes on this host that lease items,
+process them and report completion or failure
+"""
+
+import argparse
+import threading
+import time
+
+from data_layout import STATE_DIR
+from job_queue import open_job_queue
+from new_fetcher import PPMDataFetcher
+from split_pesticides_with_images import PesticideSplitter
+
+CROP_JOB_KIND = 'ppm_crop'
+PESTICIDE_JOB_KIND = 'aphia_pesticide'
+DEFAULT_QUEUE = f"sqlite:///{STATE_DIR}/work_queue.sqlite"
+
+
+def enqueue_crops(job_queue):
+    """Enqueue every crop page from the PPM crop list"""
+    fetcher = PPMDataFetcher()
+    fetcher.establish_session()
+
+    crop_list = fetcher.get_crop_list()
+    for crop in crop_list:
+        job_queue.enqueue(CROP_JOB_KIND, crop['id'], crop)
+
+    print(f"Enqueued {len(crop_list)} crops")
+    return len(crop_list)
+
+
+def enqueue_pesticides(job_queue, codes=None):
+    """Enqueue pesticide codes from the pesticide list"""
+    splitter = PesticideSplitter()
+    splitter.establish_session()
+
+    pesticide_data = splitter.load_pesticide_data()
+    if codes:
+        pesticide_data = {code: pesticide_data[code] for code in codes if code in pesticide_data}
+
+    for pest_code, pest_data in pesticide_data.items():
+        job_queue.enqueue(PESTICIDE_JOB_KIND, pest_code, {
+            'pest_code': pest_code,
+            'basic_info': pest_data['basic_info']
+        })
+
+    print(f"Enqueued {len(pesticide_data)} pesticides")
+    return len(pesticide_data)
+
+
+class LeaseHeartbeat:
+    """Extend a job lease in the background while the job is running"""
+
+    def __init__(self, job_queue, job_id, lease_token, interval):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.lease_token = lease_token
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.job_queue.extend_lease(self.job_id, self.lease_token):
+                    print(f"  Warning: lease for job {self.job_id} was lost to another worker")
+                    return
+            except Exception as e:
+                print(f"  Warning: could not extend lease for job {self.job_id}: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+
+def process_crop(fetcher, job, output_name):
+    """Fetch one crop page, raises if no records were saved"""
+    records = fetcher.fetch_crop_pesticides(job['url'], job['name'], output_name, job.get('id'))
+    if records <= 0:
+        raise RuntimeError(f"no records saved for crop {job['name']}")
+    return {'records': records}
+
+
+def process_pesticide(splitter, job, download_images):
+    """Create registration and usage range CSVs for one pesticide code"""
+    pest_data = {'basic_info': job['basic_info'], 'registrations': []}
+
+    result = splitter.create_pesticide_csv(job['pest_code'], pest_data, download_images)
+    usage_result = splitter.create_usage_range_csv(job['pest_code'], pest_data)
+
+    return {
+        'record_count': result['record_count'],
+        'image_count': result['image_count'],
+        'usage_range_count': usage_result['usage_range_count'] if usage_result else 0
+    }
+
+
+def run_worker(job_queue, kinds, lease_seconds, idle_exit, download_images, output_name, delay):
+    """Lease and process jobs until the queue stays empty"""
+    fetcher = None
+    splitter = None
+    processed = 0
+    failed = 0
+
+    while True:
+        leased = None
+        for kind in kinds:
+            leased = job_queue.lease(kind)
+            if leased:
+                break
+
+        if leased is None:
+            # Jobs waiting out a retry backoff or held by another worker still count as work left
+            if idle_exit and all(job_queue.next_available(kind) is None for kind in kinds):
+                break
+            time.sleep(5)
+            continue
+
+        job_id, lease_token, job = leased
+        try:
+            with LeaseHeartbeat(job_queue, job_id, lease_token, max(1, lease_seconds // 3)):
+                if kind == CROP_JOB_KIND:
+                    if fetcher is None:
+                        fetcher = PPMDataFetcher()
+                        fetcher.establish_session()
+                    print(f"Crop job {job_id}: {job['name']}")
+                    result = process_crop(fetcher, job, output_name)
+                else:
+                    if splitter is None:
+                        splitter = PesticideSplitter()
+                        splitter.establish_session()
+                    print(f"Pesticide job {job_id}: {job['pest_code']}")
+                    result = process_pesticide(splitter, job, download_images)
+
+            if job_queue.complete(job_id, lease_token, result):
+                processed += 1
+            else:
+                print(f"  Job {job_id} finished after its lease expired; result left to the current holder")
+        except Exception as e:
+            print(f"  Job {job_id} failed: {e}")
+            job_queue.fail(job_id, lease_token, e)
+            failed += 1
+
+        # Small delay to be respectful
+        time.sleep(delay)
+
+    return processed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue-driven workers for PPM and APHIA scraping')
+    parser.add_argument('command', choices=['enqueue', 'work', 'status', 'requeue-failed'],
+                        help='Queue operation to run')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE,
+                        help=f'Work queue location (default: {DEFAULT_QUEUE})')
+    parser.add_argument('--source', choices=['crops', 'pesticides', 'all'], default='all',
+                        help='Which work items to enqueue or process (default: all)')
+    parser.add_argument('--codes', nargs='+',
+                        help='Enqueue specific pesticide codes only (e.g., A001 F005)')
+    parser.add_argument('--lease-seconds', type=int, default=600,
+                        help='Lease timeout before an unfinished job is handed to another worker (default: 600)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Attempts before a job is marked failed (default: 3)')
+    parser.add_argument('--retry-backoff', type=int, default=30,
+                        help='Seconds before a failed job is retried, doubled per attempt (default: 30)')
+    parser.add_argument('--wait', action='store_true',
+                        help='Keep polling for new work instead of exiting when the queue is empty')
+    parser.add_argument('--no-images', action='store_true',
+                        help='Skip downloading label images for pesticide jobs')
+    parser.add_argument('-o', '--output', default='pesticide_data.csv',
+                        help='Crop output CSV filename suffix (default: pesticide_data.csv)')
+
+    args = parser.parse_args()
+
+    job_queue = open_job_queue(args.queue, args.lease_seconds, args.max_attempts, args.retry_backoff)
+    kinds = {
+        'crops': [CROP_JOB_KIND],
+        'pesticides': [PESTICIDE_JOB_KIND],
+        'all': [CROP_JOB_KIND, PESTICIDE_JOB_KIND]
+    }[args.source]
+
+    if args.command == 'enqueue':
+        if CROP_JOB_KIND in kinds:
+            enqueue_crops(job_queue)
+        if PESTICIDE_JOB_KIND in kinds:
+            enqueue_pesticides(job_queue, args.codes)
+    elif args.command == 'work':
+        processed, failed = run_worker(
+            job_queue, kinds, args.lease_seconds, not args.wait,
+            not args.no_images, args.output, 0.5
+        )
+        print(f"\n=== Worker Finished ===")
+        print(f"Jobs completed: {processed}")
+        print(f"Failed attempts: {failed}")
+    elif args.command == 'requeue-failed':
+        for kind in kinds:
+            print(f"{kind}: requeued {job_queue.requeue_failed(kind)} failed jobs")
+
+    for kind in kinds:
+        print(f"{kind}: {job_queue.counts(kind)}")
+
+
+if __name__ == '__main__':
+    main()
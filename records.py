@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Compact typed records for scraped rows
+Slotted dataclasses for registrations and usage ranges, and a columnar
+batch builder that parsers append into before building DataFrames
+"""
+
+import sys
+from dataclasses import dataclass, fields
+
+import numpy as np
+import pandas as pd
+
+from data_layout import CATEGORICAL_COLUMNS
+
+
+@dataclass(slots=True)
+class Registration:
+    """One permit row from RegisterList"""
+    permit_number: str
+    regtid: str = ''
+    regtno: str = ''
+    pesticide_name: str = ''
+    brand_name: str = ''
+    formulation_type: str = ''
+    concentration: str = ''
+    up_status: str = ''
+    mixture: str = ''
+    manufacturer: str = ''
+    foreign_manufacturer: str = ''
+    valid_date: str = ''
+    remarks: str = ''
+    image_view_url: str = ''
+    label_image_url: str = ''
+    cidecd: str = ''
+    pescnt: str = ''
+    compno: str = ''
+
+
+@dataclass(slots=True)
+class UsageRange:
+    """One usage range row from UserangeList"""
+    crop: str
+    pest_disease: str = ''
+    dosage_per_hectare: str = ''
+    dilution_ratio: str = ''
+    application_timing: str = ''
+    application_interval: str = ''
+    max_applications: str = ''
+    pre_harvest_interval: str = ''
+    application_method: str = ''
+    precautions: str = ''
+    notes: str = ''
+    approval_date: str = ''
+    original_registrar: str = ''
+
+
+@dataclass(slots=True)
+class CropUsage:
+    """Metadata shared by every row of one PPM crop table"""
+    crop_name: str
+    source_url: str
+    fetch_time: str
+
+
+def field_names(record_type):
+    """Column names of a record type, in declaration order"""
+    return [f.name for f in fields(record_type)]
+
+
+class ColumnBatch:
+    """Append-only column buffers for one record type"""
+
+    __slots__ = ('record_type', 'columns', 'length', 'interned')
+
+    def __init__(self, record_type, columns=None):
+        self.record_type = record_type
+        self.columns = columns or {name: [] for name in field_names(record_type)}
+        self.length = len(next(iter(self.columns.values()), []))
+        self.interned = [name in CATEGORICAL_COLUMNS for name in self.columns]
+
+    def __len__(self):
+        return self.length
+
+    def append(self, *values):
+        """Append one row given positionally in field order"""
+        for buffer, intern, value in zip(self.columns.values(), self.interned, values):
+            buffer.append(sys.intern(value) if intern and type(value) is str else value)
+        self.length += 1
+
+    def append_record(self, record):
+        """Append one record object"""
+        self.append(*(getattr(record, name) for name in self.columns))
+
+    def records(self):
+        """Materialize the rows as record objects"""
+        return [self.record_type(*row) for row in zip(*self.columns.values())]
+
+    def to_frame(self, **constants):
+        """Build a DataFrame straight from the column buffers, adding constant columns"""
+        df = categorize(pd.DataFrame(self.columns))
+        for name, value in constants.items():
+            df[name] = constant_column(value, len(df)) if name in CATEGORICAL_COLUMNS else value
+        return df
+
+
+def constant_column(value, length):
+    """A categorical column holding one value, stored as one byte per row"""
+    return pd.Categorical.from_codes(np.zeros(length, dtype='int8'), categories=[value])
+
+
+def categorize(df):
+    """Convert the repetitive columns of a DataFrame to the category dtype"""
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def records_to_frame(records, record_type, **constants):
+    """Build a DataFrame from record objects, one column at a time"""
+    batch = ColumnBatch(record_type)
+    for record in records:
+        batch.append_record(record)
+    return batch.to_frame(**constants)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Combined refresh of the PPM crop crawl and the APHIA registry crawl
+Both sources, including label image downloads, run overlapped in one process
+on a single asyncio event loop, sharing one scheduler that bounds the total
+number of in-flight jobs
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from image_downloader import AsyncImageDownloader
+from new_fetcher import PPMDataFetcher
+from page_archive import ARCHIVE_DIR, PageArchive, reparse_archive
+from scraper_core import HttpClient
+from split_pesticides_with_images import PesticideSplitter
+
+
+class RefreshScheduler:
+    """Run blocking fetch jobs on worker threads under shared and per-source limits"""
+
+    def __init__(self, total_workers=6):
+        self.total = asyncio.Semaphore(total_workers)
+        self.sources = {}
+
+    def add_source(self, name, workers):
+        self.sources[name] = asyncio.Semaphore(workers)
+
+    async def run(self, source, func, *args):
+        async with self.sources[source], self.total:
+            return await asyncio.to_thread(func, *args)
+
+
+async def refresh_crops(scheduler, fetcher, crops, output_name, stats):
+    """Fetch every crop page through the scheduler"""
+    def fetch(i, crop):
+        print(f"[PPM {i}/{len(crops)}] {crop['name']}")
+        return fetcher.fetch_crop_pesticides(crop['url'], crop['name'], output_name, crop['id'])
+
+    async def fetch_one(i, crop):
+        records = await scheduler.run('ppm', fetch, i, crop)
+        if records > 0:
+            stats['crops'] += 1
+            stats['crop_records'] += records
+
+    await asyncio.gather(*(fetch_one(i, crop) for i, crop in enumerate(crops, 1)))
+
+
+async def download_label_images(scheduler, downloader, registrations, pest_code, pest_name):
+    """Resolve and download label images as scheduler jobs, returns {permit_number: image path | date}"""
+    download_date = datetime.now().strftime('%Y-%m-%d')
+
+    async def run_image_job(func, *args):
+        return await scheduler.run('images', func, *args)
+
+    registrations = [r for r in registrations if r.regtid and r.regtno]
+    paths = await asyncio.gather(*(
+        downloader.download_one(registration, pest_code, pest_name, download_date, run=run_image_job)
+        for registration in registrations
+    ))
+    return {registration.permit_number: path for registration, path in zip(registrations, paths) if path}
+
+
+async def refresh_pesticides(scheduler, splitter, pesticides, download_images, stats, image_workers=4):
+    """Create registration and usage range CSVs for every pesticide through the scheduler
+
+    Each pesticide runs as three scheduler steps: fetch registrations, download
+    label images (one job per image under the 'images' limit) and write CSVs.
+    """
+    downloader = AsyncImageDownloader(splitter, concurrency=image_workers) if download_images else None
+
+    def write(pest_code, pest_data, registrations, image_paths):
+        result = splitter.create_pesticide_csv(pest_code, pest_data, download_images=False,
+                                               known_image_paths=image_paths, registrations=registrations)
+        usage_result = splitter.create_usage_range_csv(pest_code, pest_data)
+        return result, usage_result
+
+    async def process_one(i, pest_code, pest_data):
+        try:
+            print(f"[APHIA {i}/{len(pesticides)}] {pest_code}")
+            registrations = await scheduler.run('aphia', splitter.collect_registrations, pest_code, pest_data)
+            image_paths = {}
+            if downloader is not None:
+                image_paths = await download_label_images(
+                    scheduler, downloader, registrations, pest_code, pest_data['basic_info']['pesticide_name']
+                )
+            result, usage_result = await scheduler.run('aphia', write, pest_code, pest_data, registrations,
+                                                       image_paths)
+        except Exception as e:
+            print(f"  Error processing {pest_code}: {e}")
+            return
+        stats['pesticides'] += 1
+        stats['registrations'] += result['registration_count']
+        stats['images'] += result['image_count']
+        if usage_result:
+            stats['usage_ranges'] += usage_result['usage_range_count']
+
+    await asyncio.gather(*(
+        process_one(i, pest_code, pest_data)
+        for i, (pest_code, pest_data) in enumerate(pesticides.items(), 1)
+    ))
+
+
+async def refresh_all(args):
+    scheduler = RefreshScheduler(total_workers=args.crop_workers + args.pesticide_workers + args.image_workers)
+    scheduler.add_source('ppm', args.crop_workers)
+    scheduler.add_source('aphia', args.pesticide_workers)
+    scheduler.add_source('images', args.image_workers)
+
+    # One client per site so each keeps its own cookies and rate limit
+    fetcher = PPMDataFetcher(http=HttpClient(pool_size=args.crop_workers, min_interval=args.min_interval),
+                             rewrite_unchanged=args.force)
+    splitter = PesticideSplitter(
+        image_workers=args.image_workers,
+        http=HttpClient(
+            headers={'Referer': 'https://pesticide.aphia.gov.tw/'},
+            pool_size=args.pesticide_workers + args.image_workers,
+            min_interval=args.min_interval
+        )
+    )
+    if args.archive:
+        archive = PageArchive(args.archive_dir)
+        fetcher.http.add_response_hook(archive.hook)
+        splitter.http.add_response_hook(archive.hook)
+
+    # Warm up both sessions concurrently
+    await asyncio.gather(
+        asyncio.to_thread(fetcher.establish_session),
+        asyncio.to_thread(splitter.establish_session)
+    )
+    crop_list, pesticide_data = await asyncio.gather(
+        asyncio.to_thread(fetcher.get_crop_list),
+        asyncio.to_thread(splitter.load_pesticide_data)
+    )
+
+    if not args.force:
+        existing_crops = fetcher.get_existing_crops(args.output)
+        crop_list = [crop for crop in crop_list if not fetcher.is_crop_saved(crop, args.output, existing_crops)]
+
+    if args.limit:
+        crop_list = crop_list[:args.limit]
+        pesticide_data = dict(list(pesticide_data.items())[:args.limit])
+
+    print(f"Crops to process: {len(crop_list)}")
+    print(f"Pesticides to process: {len(pesticide_data)}")
+
+    stats = {
+        'crops': 0, 'crop_records': 0,
+        'pesticides': 0, 'registrations': 0, 'images': 0, 'usage_ranges': 0
+    }
+    await asyncio.gather(
+        refresh_crops(scheduler, fetcher, crop_list, args.output, stats),
+        refresh_pesticides(scheduler, splitter, pesticide_data, not args.no_images, stats, args.image_workers)
+    )
+
+    stats['requests'] = fetcher.http.request_count + splitter.http.request_count
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh PPM crop data and APHIA registry data in one overlapped run')
+    parser.add_argument('-o', '--output', default='pesticide_data.csv',
+                        help='Crop output CSV filename suffix (default: pesticide_data.csv)')
+    parser.add_argument('-l', '--limit', type=int,
+                        help='Limit number of crops and pesticides to process (for testing)')
+    parser.add_argument('--force', action='store_true',
+                        help='Force re-download all crops (ignore existing files)')
+    parser.add_argument('--no-images', action='store_true',
+                        help='Skip downloading label images')
+    parser.add_argument('--crop-workers', type=int, default=2,
+                        help='Concurrent PPM crop jobs (default: 2)')
+    parser.add_argument('--pesticide-workers', type=int, default=2,
+                        help='Concurrent APHIA pesticide jobs (default: 2)')
+    parser.add_argument('--image-workers', type=int, default=4,
+                        help='Concurrent label image jobs across all pesticides (default: 4)')
+    parser.add_argument('--min-interval', type=float, default=0.25,
+                        help='Minimum seconds between requests to the same site (default: 0.25)')
+    parser.add_argument('--archive', action='store_true',
+                        help='Archive every fetched page for later offline re-parsing')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR,
+                        help=f'Page archive directory (default: {ARCHIVE_DIR})')
+    parser.add_argument('--reparse', action='store_true',
+                        help='Rebuild all CSV outputs from the page archive without network access')
+    parser.add_argument('--reparse-workers', type=int,
+                        help='Processes used by --reparse (default: CPU count)')
+
+    args = parser.parse_args()
+
+    if args.reparse:
+        print("=== Offline Re-parse From Page Archive ===")
+        start_time = time.time()
+        stats = reparse_archive(args.archive_dir, args.reparse_workers, args.output)
+        print(f"\n=== Summary ===")
+        print(f"Crops rebuilt: {stats['crops']} ({stats['crop_records']} records)")
+        print(f"Pesticides rebuilt: {stats['pesticides']} ({stats['registrations']} registrations)")
+        print(f"Errors: {stats['errors']}")
+        print(f"Elapsed: {time.time() - start_time:.1f}s")
+        return
+
+    print("=== Combined PPM + APHIA Refresh ===")
+    start_time = time.time()
+    stats = asyncio.run(refresh_all(args))
+
+    print(f"\n=== Summary ===")
+    print(f"Crops saved: {stats['crops']} ({stats['crop_records']} records)")
+    print(f"Pesticides processed: {stats['pesticides']}")
+    print(f"Registrations: {stats['registrations']}")
+    print(f"Images downloaded: {stats['images']}")
+    print(f"Usage range records: {stats['usage_ranges']}")
+    print(f"HTTP requests: {stats['requests']}")
+    print(f"Elapsed: {time.time() - start_time:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
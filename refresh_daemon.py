@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Priority-aware refresh scheduler daemon
+Keeps PPM crop pages and APHIA pesticide codes fresh continuously: every item
+has its own revisit interval and priority (permits close to their valid date,
+recently changed codes, crops with new entries come first) and all fetching
+stays inside a requests-per-hour budget
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from contextlib import closing
+
+from data_layout import STATE_DIR
+from expiry_index import EXPIRY_INDEX_PATH, ExpiryIndex, index_is_stale
+from new_fetcher import PPMDataFetcher
+from scraper_core import HttpClient, pesticide_file
+from snapshot_diff import CHANGES_DIR, row_hash
+from split_pesticides_with_images import PesticideSplitter
+
+SCHEDULE_PATH = os.path.join(STATE_DIR, 'refresh_schedule.sqlite')
+
+CROP_ITEM = 'crop'
+PESTICIDE_ITEM = 'pesticide'
+
+DAY = 24 * 3600
+DEFAULT_INTERVAL = 7 * DAY
+RETRY_DELAY = 3600
+
+# Requests per item before any history exists: one crop page; RegisterList twice plus UserangeList
+DEFAULT_COST = {CROP_ITEM: 1, PESTICIDE_ITEM: 3}
+
+
+class RefreshSchedule:
+    """SQLite table of refresh items with priority, revisit interval and next due time"""
+
+    def __init__(self, db_path=SCHEDULE_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    kind TEXT NOT NULL,
+                    item_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    interval_seconds REAL NOT NULL,
+                    next_due REAL NOT NULL DEFAULT 0,
+                    last_run REAL NOT NULL DEFAULT 0,
+                    last_digest TEXT NOT NULL DEFAULT '',
+                    last_cost INTEGER NOT NULL DEFAULT 0,
+                    changed INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (kind, item_key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_items_due ON items (next_due)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def upsert(self, kind, item_key, payload, priority, interval):
+        """Add an item or update its priority and interval, pulling its due time forward if the interval shrank"""
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                INSERT INTO items (kind, item_key, payload, priority, interval_seconds)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_key) DO UPDATE SET
+                    payload = excluded.payload,
+                    priority = excluded.priority,
+                    interval_seconds = excluded.interval_seconds,
+                    next_due = CASE WHEN last_run = 0 THEN next_due
+                                    ELSE MIN(next_due, last_run + excluded.interval_seconds) END
+            """, (kind, item_key, json.dumps(payload, ensure_ascii=False), priority, interval))
+
+    def item(self, kind, item_key):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM items WHERE kind = ? AND item_key = ?", (kind, item_key)).fetchone()
+        return dict(row) if row else None
+
+    def due(self, now, limit=1):
+        """Items due at `now`, highest priority first, then longest overdue"""
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("""
+                SELECT * FROM items WHERE next_due <= ?
+                ORDER BY priority DESC, next_due ASC LIMIT ?
+            """, (now, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def next_due_time(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT MIN(next_due) FROM items").fetchone()
+        return row[0]
+
+    def record_run(self, kind, item_key, digest, cost, now):
+        """Store a finished refresh and schedule the next visit, returns True when the content changed"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT last_digest, interval_seconds FROM items WHERE kind = ? AND item_key = ?",
+                               (kind, item_key)).fetchone()
+            changed = bool(row and row[0] and digest != row[0])
+            conn.execute("""
+                UPDATE items SET last_run = ?, last_digest = ?, last_cost = ?, changed = ?,
+                    next_due = ? + interval_seconds
+                WHERE kind = ? AND item_key = ?
+            """, (now, digest, cost, int(changed), now, kind, item_key))
+        return changed
+
+    def record_failure(self, kind, item_key, now):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE items SET next_due = ? WHERE kind = ? AND item_key = ?",
+                         (now + RETRY_DELAY, kind, item_key))
+
+    def counts(self, now):
+        with closing(self._connect()) as conn:
+            return {
+                kind: {'total': total, 'due': due}
+                for kind, total, due in conn.execute("""
+                    SELECT kind, COUNT(*), SUM(next_due <= ?) FROM items GROUP BY kind
+                """, (now,))
+            }
+
+
+class RequestBudget:
+    """Sliding one-hour window of request counts"""
+
+    def __init__(self, requests_per_hour):
+        self.requests_per_hour = requests_per_hour
+        self.spent = deque()  # (timestamp, requests)
+
+    def used(self, now):
+        while self.spent and self.spent[0][0] <= now - 3600:
+            self.spent.popleft()
+        return sum(count for _, count in self.spent)
+
+    def wait_time(self, cost, now):
+        """Seconds until `cost` more requests fit in the window"""
+        used = self.used(now)
+        cost = min(cost, self.requests_per_hour)
+        if used + cost <= self.requests_per_hour:
+            return 0
+        # Drop the oldest spends until the new cost fits
+        freed = 0
+        for spent_at, count in self.spent:
+            freed += count
+            if used - freed + cost <= self.requests_per_hour:
+                return spent_at + 3600 - now
+        return 3600
+
+    def charge(self, cost, now):
+        if cost > 0:
+            self.spent.append((now, cost))
+
+
+def pesticide_digest(pest_code, pest_name):
+    """Hash of the non-volatile content of a pesticide's CSV outputs"""
+    digest = hashlib.sha1()
+    for suffix in ('', '_usage_range', '_permit_usage_range'):
+        csv_path = pesticide_file(pest_code, pest_name, suffix)
+        if not os.path.exists(csv_path):
+            continue
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            for row_digest in sorted(row_hash(row) for row in csv.DictReader(f)):
+                digest.update(row_digest.encode('ascii'))
+    return digest.hexdigest()
+
+
+def recently_changed_codes(changes_dir, expiry_frame):
+    """Pesticide codes touched by the most recent snapshot change set"""
+    change_sets = sorted(glob.glob(os.path.join(changes_dir, '*.jsonl')))
+    if not change_sets:
+        return set()
+
+    permit_codes = dict(zip(expiry_frame['permit_number'], expiry_frame['pesticide_code']))
+    codes = set()
+    with open(change_sets[-1], encoding='utf-8') as f:
+        for line in f:
+            change = json.loads(line)
+            if change['dataset'] == 'registration':
+                code = change.get('values', {}).get('pesticide_code') or permit_codes.get(change['key'])
+                if code:
+                    codes.add(str(code))
+            elif change['dataset'] == 'usage_range':
+                codes.add(change['key'].split('|')[0])
+    return codes
+
+
+class RefreshDaemon:
+    def __init__(self, args):
+        self.args = args
+        self.schedule = RefreshSchedule(args.schedule)
+        self.budget = RequestBudget(args.budget)
+        self.fetcher = PPMDataFetcher(http=HttpClient(min_interval=args.min_interval))
+        # The schedule decides when a pesticide is due, so per-permit usage is always refetched
+        self.splitter = PesticideSplitter(
+            per_permit_usage=args.per_permit_usage,
+            usage_cache_ttl=0,
+            http=HttpClient(headers={'Referer': 'https://pesticide.aphia.gov.tw/'}, min_interval=args.min_interval)
+        )
+        self.pesticide_data = {}
+        self.sessions_ready = False
+        self.crop_list_fetched = False
+
+    def ensure_sessions(self):
+        if not self.sessions_ready:
+            self.fetcher.establish_session()
+            self.splitter.establish_session()
+            self.sessions_ready = True
+
+    def plan(self):
+        """Re-derive every item's priority and revisit interval from local state"""
+        args = self.args
+        if index_is_stale(EXPIRY_INDEX_PATH):
+            expiry = ExpiryIndex.build()
+            expiry.save()
+        else:
+            expiry = ExpiryIndex.load()
+
+        urgent = set(expiry.expiring_within(args.urgent_days)['pesticide_code'].astype(str))
+        urgent |= set(expiry.expired_not_revoked()['pesticide_code'].astype(str))
+        soon = set(expiry.expiring_within(args.soon_days)['pesticide_code'].astype(str))
+        changed = recently_changed_codes(CHANGES_DIR, expiry.frame)
+
+        self.pesticide_data = self.splitter.load_pesticide_data()
+        for pest_code, pest_data in self.pesticide_data.items():
+            pest_code = str(pest_code)
+            priority, interval = 0, args.interval * DAY
+            if pest_code in urgent:
+                priority, interval = 3, DAY
+            elif pest_code in soon:
+                priority, interval = 2, 3 * DAY
+            item = self.schedule.item(PESTICIDE_ITEM, pest_code)
+            if pest_code in changed or (item and item['changed']):
+                priority, interval = max(priority, 1) + 1, min(interval, 2 * DAY)
+            self.schedule.upsert(PESTICIDE_ITEM, pest_code, {'basic_info': pest_data['basic_info']}, priority, interval)
+
+        # Crops come from the catalogue plus the live crop list, so crops added to the site get scheduled
+        crops = {crop_id: {'id': crop_id, 'name': entry['name'], 'url': entry['url']}
+                 for crop_id, entry in list(self.fetcher.catalogue.entries.items())}
+        try:
+            self.ensure_sessions()
+            if self.crop_list_fetched:
+                self.fetcher.crop_page_html = None  # Only the first pass may reuse the handshake page
+            crops.update((crop['id'], crop) for crop in self.fetcher.get_crop_list())
+            self.crop_list_fetched = True
+        except Exception as e:
+            print(f"  Error fetching crop list, planning catalogued crops only: {e}")
+        for crop_id, crop in crops.items():
+            item = self.schedule.item(CROP_ITEM, crop_id)
+            # Crops whose table changed on the last visit are likely still receiving new entries
+            priority, interval = (2, 2 * DAY) if item and item['changed'] else (0, args.interval * DAY)
+            self.schedule.upsert(CROP_ITEM, crop_id, crop, priority, interval)
+
+        print(f"Planned: {self.schedule.counts(time.time())} "
+              f"(urgent codes: {len(urgent)}, expiring soon: {len(soon)}, recently changed: {len(changed)})")
+
+    def refresh(self, item):
+        """Refresh one item, returns its new content digest"""
+        payload = json.loads(item['payload'])
+        if item['kind'] == CROP_ITEM:
+            self.fetcher.fetched_crops.pop(payload['id'], None)
+            records = self.fetcher.fetch_crop_pesticides(payload['url'], payload['name'], self.args.output, payload['id'])
+            if records <= 0:
+                raise RuntimeError(f"no records saved for crop {payload['name']}")
+            entry = self.fetcher.catalogue.get(payload['id'])
+            return entry['content_hash'] if entry else ''
+
+        pest_code = item['item_key']
+        pest_data = {'basic_info': payload['basic_info'], 'registrations': []}
+        self.splitter.create_pesticide_csv(pest_code, pest_data, download_images=self.args.images)
+        self.splitter.create_usage_range_csv(pest_code, pest_data)
+        return pesticide_digest(pest_code, payload['basic_info']['pesticide_name'])
+
+    def request_count(self):
+        return self.fetcher.http.request_count + self.splitter.http.request_count
+
+    def run(self):
+        args = self.args
+        next_plan = 0
+        refreshed = 0
+        while True:
+            now = time.time()
+            if now >= next_plan:
+                before = self.request_count()
+                self.plan()
+                self.budget.charge(self.request_count() - before, time.time())
+                next_plan = now + args.replan_minutes * 60
+
+            due = self.schedule.due(now)
+            if not due:
+                if args.once:
+                    break
+                next_due = self.schedule.next_due_time() or now + 60
+                time.sleep(max(1, min(next_due - now, next_plan - now, 300)))
+                continue
+
+            item = due[0]
+            cost = item['last_cost'] or DEFAULT_COST[item['kind']]
+            wait = self.budget.wait_time(cost, now)
+            if wait > 0:
+                print(f"Request budget reached, waiting {wait:.0f}s")
+                time.sleep(wait)
+                continue
+
+            self.ensure_sessions()
+            print(f"[priority {item['priority']}] Refreshing {item['kind']} {item['item_key']}")
+            before = self.request_count()
+            try:
+                digest = self.refresh(item)
+            except Exception as e:
+                print(f"  Error refreshing {item['kind']} {item['item_key']}: {e}")
+                self.schedule.record_failure(item['kind'], item['item_key'], time.time())
+                self.budget.charge(self.request_count() - before, time.time())
+                continue
+
+            spent = self.request_count() - before
+            self.budget.charge(spent, time.time())
+            if self.schedule.record_run(item['kind'], item['item_key'], digest, spent, time.time()):
+                print(f"  Content changed, revisiting sooner")
+            refreshed += 1
+            if args.max_items and refreshed >= args.max_items:
+                break
+
+        return refreshed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Continuously refresh PPM and APHIA data by priority within a request budget')
+    parser.add_argument('--schedule', default=SCHEDULE_PATH,
+                        help=f'Schedule database (default: {SCHEDULE_PATH})')
+    parser.add_argument('--budget', type=int, default=600,
+                        help='Maximum requests per hour across both sites (default: 600)')
+    parser.add_argument('--interval', type=float, default=7,
+                        help='Default revisit interval in days (default: 7)')
+    parser.add_argument('--urgent-days', type=int, default=30,
+                        help='Codes with permits expiring within this many days are refreshed daily (default: 30)')
+    parser.add_argument('--soon-days', type=int, default=90,
+                        help='Codes with permits expiring within this many days are refreshed every 3 days (default: 90)')
+    parser.add_argument('--replan-minutes', type=int, default=60,
+                        help='How often priorities are recomputed (default: 60)')
+    parser.add_argument('--min-interval', type=float, default=1.0,
+                        help='Minimum seconds between requests to the same site (default: 1.0)')
+    parser.add_argument('--images', action='store_true',
+                        help='Also download label images when refreshing pesticides')
+    parser.add_argument('--per-permit-usage', action='store_true',
+                        help='Also refresh per-permit usage ranges')
+    parser.add_argument('--once', action='store_true',
+                        help='Refresh everything currently due, then exit')
+    parser.add_argument('--max-items', type=int,
+                        help='Stop after refreshing this many items')
+    parser.add_argument('-o', '--output', default='pesticide_data.csv',
+                        help='Crop output CSV filename suffix (default: pesticide_data.csv)')
+
+    args = parser.parse_args()
+
+    print("=== Refresh Scheduler ===")
+    print(f"Budget: {args.budget} requests/hour, default revisit every {args.interval:g} days")
+    refreshed = RefreshDaemon(args).run()
+    print(f"Refreshed {refreshed} items")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Dry-run request planner and cost estimator
+Counts the requests, image downloads, bytes and wall time a crawl would
+cost, per stage, from the cached pesticide list, crop catalogue, saved
+session and files already on disk - without fetching any content
+"""
+
+import glob
+import json
+import math
+import os
+import random
+from collections import Counter
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from data_layout import MANIFEST_NAME, dataset_files
+from page_archive import ARCHIVE_DIR, PageArchive
+
+# Typical round trip per request when nothing better is known
+DEFAULT_LATENCY = 0.6
+
+# Uncompressed page sizes in bytes, replaced by archive samples when available
+DEFAULT_PAGE_BYTES = {
+    'Index.aspx': 20000,
+    'Menu.aspx': 30000,
+    'PLC02.aspx': 150000,
+    'PLC0101.aspx': 120000,
+    'RegisterList': 40000,
+    'UserangeList': 25000,
+    'RegisterViewMark': 8000,
+    'Pesticide': 30000,
+}
+DEFAULT_IMAGE_BYTES = 400000
+DEFAULT_REGISTRATIONS_PER_CODE = 5
+
+
+def page_kind(url):
+    """Last path segment of a URL, e.g. RegisterList or PLC0101.aspx"""
+    return [part for part in urlparse(url).path.split('/') if part][-1]
+
+
+def observed_page_bytes(archive_dir=ARCHIVE_DIR, sample_size=20):
+    """Average page size per page kind from a sample of the page archive"""
+    page_bytes = dict(DEFAULT_PAGE_BYTES)
+    archive = PageArchive(archive_dir)
+    by_kind = {}
+    for key, entry in archive.latest_entries().items():
+        by_kind.setdefault(page_kind(key), []).append(entry)
+    for kind, entries in by_kind.items():
+        sample = random.sample(entries, min(sample_size, len(entries)))
+        try:
+            page_bytes[kind] = sum(len(archive.read(entry)) for entry in sample) // len(sample)
+        except OSError:
+            continue
+    return page_bytes
+
+
+def observed_image_bytes(data_dir='data'):
+    """Average size of label images already on disk"""
+    sizes = [os.path.getsize(path) for path in glob.glob(os.path.join(data_dir, 'pesticides', '*', 'labels', '*'))
+             if os.path.isfile(path) and not path.endswith(('.part', MANIFEST_NAME))]
+    return sum(sizes) // len(sizes) if sizes else DEFAULT_IMAGE_BYTES
+
+
+def registrations_per_code(data_dir='data'):
+    """Registration counts per pesticide code from the CSVs of earlier runs"""
+    counts = Counter()
+    for file_path in dataset_files('registrations', data_dir):
+        df = pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                         usecols=lambda c: c in ('data_type', 'pesticide_code'))
+        if 'data_type' in df:
+            counts.update(df.loc[df['data_type'] == 'registration', 'pesticide_code'])
+    return counts
+
+
+class RunPlan:
+    """Per-stage request, download, byte and time estimates"""
+
+    def __init__(self, title, latency=DEFAULT_LATENCY, min_interval=0.0):
+        self.title = title
+        self.latency = latency
+        self.min_interval = min_interval
+        self.stages = []
+        self.notes = []
+
+    def add_stage(self, name, requests, concurrency=1, bytes_per_request=0, downloads=0, download_bytes=0,
+                  fixed_delay=0.0):
+        """Add a stage; fixed_delay is sleep time the crawler adds on top of the requests"""
+        network_seconds = requests * self.latency / max(1, concurrency)
+        seconds = max(network_seconds, requests * self.min_interval) + fixed_delay
+        self.stages.append({
+            'stage': name,
+            'requests': int(requests),
+            'downloads': int(downloads),
+            'bytes': int(requests * bytes_per_request + download_bytes),
+            'seconds': seconds
+        })
+
+    def totals(self):
+        return {
+            'requests': sum(s['requests'] for s in self.stages),
+            'downloads': sum(s['downloads'] for s in self.stages),
+            'bytes': sum(s['bytes'] for s in self.stages),
+            'seconds': sum(s['seconds'] for s in self.stages)
+        }
+
+    def print(self):
+        print(f"\n=== Plan: {self.title} ===")
+        print(f"{'Stage':<40}{'Requests':>10}{'Images':>9}{'Bytes':>12}{'Time':>11}")
+        for stage in self.stages + [dict(stage='Total', **self.totals())]:
+            print(f"{stage['stage']:<40}{stage['requests']:>10}{stage['downloads']:>9}"
+                  f"{format_bytes(stage['bytes']):>12}{format_seconds(stage['seconds']):>11}")
+        print(f"(assuming {self.latency:g}s per request"
+              + (f", at most one request per {self.min_interval:g}s" if self.min_interval else '') + ")")
+        for note in self.notes:
+            print(f"Note: {note}")
+
+
+def format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+def format_seconds(seconds):
+    seconds = int(math.ceil(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def plan_pesticide_run(pest_codes, download_images=True, usage_range_only=False, per_permit_usage=False,
+                       defer_images=False, image_workers=4, usage_workers=4, delay=0.5, data_dir='data'):
+    """Plan split_pesticides_with_images.py over the given codes"""
+    page_bytes = observed_page_bytes(os.path.join(data_dir, 'archive'))
+    known_counts = registrations_per_code(data_dir)
+    average = (sum(known_counts.values()) / len(known_counts)) if known_counts else DEFAULT_REGISTRATIONS_PER_CODE
+    registrations = round(sum(known_counts.get(code, average) for code in pest_codes))
+    codes = len(pest_codes)
+
+    plan = RunPlan(f"split_pesticides_with_images.py, {codes} pesticides")
+    plan.add_stage('Session warm-up', 1, bytes_per_request=page_bytes['Pesticide'])
+    if not usage_range_only:
+        plan.add_stage('RegisterList (registrations)', codes, bytes_per_request=page_bytes['RegisterList'])
+    plan.add_stage('RegisterList (usage range, repeated)', codes, bytes_per_request=page_bytes['RegisterList'])
+    plan.add_stage('UserangeList (general)', codes, bytes_per_request=page_bytes['UserangeList'],
+                   fixed_delay=codes * delay)
+    if per_permit_usage:
+        plan.add_stage('UserangeList (per permit, at most)', registrations, concurrency=usage_workers,
+                       bytes_per_request=page_bytes['UserangeList'])
+        plan.notes.append("per-permit queries are deduplicated and disk-cached, so the real count can be lower")
+    if download_images and not usage_range_only:
+        image_bytes = observed_image_bytes(data_dir)
+        name = 'Label images (queued for consumer)' if defer_images else 'Label images'
+        plan.add_stage(f'{name}: view pages', registrations, concurrency=image_workers,
+                       bytes_per_request=page_bytes['RegisterViewMark'])
+        plan.add_stage(f'{name}: downloads', registrations, concurrency=image_workers,
+                       downloads=registrations, download_bytes=registrations * image_bytes)
+    unknown = sum(1 for code in pest_codes if code not in known_counts)
+    if unknown:
+        plan.notes.append(f"{unknown} codes have no earlier output; assumed {average:.1f} registrations each")
+    return plan
+
+
+def plan_crop_run(crop_count, handshake=True, delay=0.5, data_dir='data', min_interval=0.0):
+    """Plan new_fetcher.py over crop_count crop pages"""
+    page_bytes = observed_page_bytes(os.path.join(data_dir, 'archive'))
+    plan = RunPlan(f"new_fetcher.py, {crop_count} crops", min_interval=min_interval)
+    if handshake:
+        plan.add_stage('Session handshake (Index, Menu, PLC02)', 3,
+                       bytes_per_request=(page_bytes['Index.aspx'] + page_bytes['Menu.aspx']
+                                          + page_bytes['PLC02.aspx']) / 3)
+    else:
+        plan.notes.append("a saved session is still fresh, so the handshake is skipped")
+    plan.add_stage('Crop pages (PLC0101)', crop_count, bytes_per_request=page_bytes['PLC0101.aspx'],
+                   fixed_delay=crop_count * delay)
+    return plan
+
+
+def saved_crop_page(session_path):
+    """Crop list page stored with the last PPM session, regardless of its age"""
+    if not os.path.exists(session_path):
+        return None
+    with open(session_path, encoding='utf-8') as f:
+        return json.load(f).get('state', {}).get('crop_page_html')
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Shared scraping core for the PPM and APHIA fetchers
+One HTTP client (connection pooling, rate limit, cache/response hooks),
+one CSV output writer and one path-naming scheme
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+
+from data_layout import PESTICIDES_DIR, REGULATORY_DIR, STATE_DIR, USAGE_DIR
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8'
+}
+
+# ASP.NET hidden form fields that carry page state between requests
+ASPNET_STATE_FIELDS = ('__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION')
+
+
+def safe_name(name):
+    """Sanitize a crop or pesticide name for use in file and folder names"""
+    return re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', str(name))
+
+
+def pesticide_dir(pest_code, pest_name):
+    """Folder holding all files for one pesticide, e.g. data/pesticides/A001_三亞蟎AMITRAZ"""
+    return os.path.join(PESTICIDES_DIR, f"{pest_code}_{safe_name(pest_name)}")
+
+
+def pesticide_file(pest_code, pest_name, suffix=''):
+    """Path of a per-pesticide file, e.g. suffix '_usage_range' gives [CODE_NAME]_usage_range.csv"""
+    return os.path.join(pesticide_dir(pest_code, pest_name), f"{pest_code}_{safe_name(pest_name)}{suffix}.csv")
+
+
+def crop_usage_path(crop_name, base_filename):
+    """Path of a PPM crop usage file, e.g. data/usage/水稻_pesticide_data.csv"""
+    return os.path.join(USAGE_DIR, f"{safe_name(crop_name)}_{base_filename}")
+
+
+def write_csv(data, csv_path):
+    """Write a DataFrame or list of records to CSV, creating the parent folder"""
+    import pandas as pd
+
+    parent = os.path.dirname(csv_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+    return len(df)
+
+
+def write_json_atomic(path, data, **dump_args):
+    """Write JSON through a private temp file in the same folder, then move it into place"""
+    parent = os.path.dirname(path) or '.'
+    os.makedirs(parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=parent, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, **dump_args)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock across processes, held on a sidecar '<path>.lock' file"""
+    lock_path = f"{path}.lock"
+    parent = os.path.dirname(lock_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after ~10 seconds; keep waiting
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def aspnet_state(html):
+    """Extract the ASP.NET hidden state fields from a page"""
+    state = {}
+    for field in ASPNET_STATE_FIELDS:
+        match = re.search(rf'id="{field}"[^>]*value="([^"]*)"', html)
+        if match:
+            state[field] = match.group(1)
+    return state
+
+
+class HttpClient:
+    """requests.Session wrapper shared by all fetchers
+
+    cache, when given, is any object with get(url, params) returning a cached
+    response (or None) and store(url, params, response). Response hooks are
+    called as hook(url, params, response) after every network fetch. An
+    offline client raises instead of touching the network.
+    """
+
+    def __init__(self, headers=None, pool_size=10, min_interval=0.0, cache=None, offline=False):
+        self.session = requests.Session()
+        self.headers = dict(DEFAULT_HEADERS)
+        if headers:
+            self.headers.update(headers)
+        self.session.headers.update(self.headers)
+
+        self.min_interval = min_interval
+        self.cache = cache
+        self.offline = offline
+        self.response_hooks = []
+        self.request_count = 0
+        self._rate_lock = threading.Lock()
+        self._next_request_time = 0.0
+        self.pool_size = 0
+        self.ensure_pool(pool_size)
+
+    def ensure_pool(self, size):
+        """Grow the connection pool so `size` threads can share the session"""
+        if size <= self.pool_size:
+            return
+        adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_size = size
+
+    def save_session(self, path, **state):
+        """Persist cookies plus any extra state so another run or process can reuse the session"""
+        cookies = [{
+            'name': cookie.name,
+            'value': cookie.value,
+            'domain': cookie.domain,
+            'path': cookie.path,
+            'expires': cookie.expires,
+            'secure': cookie.secure,
+            'rest': {'HttpOnly': None} if cookie.has_nonstandard_attr('HttpOnly') else {}
+        } for cookie in self.session.cookies]
+        write_json_atomic(path, {'saved_at': time.time(), 'cookies': cookies, 'state': state})
+
+    def restore_session(self, path, max_age):
+        """Load cookies saved by save_session, returns the extra state or None when missing or too old"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - saved.get('saved_at', 0) > max_age:
+            return None
+        cookies = saved.get('cookies', [])
+        if isinstance(cookies, dict):
+            cookies = [{'name': name, 'value': value} for name, value in cookies.items()]  # Older name-only format
+        for cookie in cookies:
+            if cookie.get('expires') and cookie['expires'] < time.time():
+                continue
+            self.session.cookies.set_cookie(create_cookie(**cookie))
+        return saved.get('state', {})
+
+    def add_response_hook(self, hook):
+        """Register hook(url, params, response) called after each network fetch"""
+        self.response_hooks.append(hook)
+
+    def _wait_for_rate_limit(self):
+        """Space requests at least min_interval seconds apart across all threads"""
+        if self.min_interval <= 0:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def get(self, url, params=None, stream=False, **kwargs):
+        """GET through the cache, rate limiter and response hooks"""
+        if self.cache is not None and not stream:
+            cached = self.cache.get(url, params)
+            if cached is not None:
+                return cached
+
+        if self.offline:
+            raise RuntimeError(f"offline client cannot fetch {url}")
+
+        self._wait_for_rate_limit()
+        response = self.session.get(url, params=params, stream=stream, **kwargs)
+        self.request_count += 1
+
+        if not stream:
+            for hook in self.response_hooks:
+                hook(url, params, response)
+            if self.cache is not None and response.status_code == 200:
+                self.cache.store(url, params, response)
+
+        return response
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Snapshot and change detection for scraped data
+Hashes every row by a stable key and compares against the previous snapshot
+to report new/revoked permits, valid date changes, usage range rows and
+tolerance changes in a single linear pass
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from data_layout import dataset_files
+from numeric_fields import NUMERIC_COLUMNS
+
+SNAPSHOT_DIR = 'data/snapshots'
+CHANGES_DIR = 'data/changes'
+
+# Columns that change on every run (or are derived from other columns) and must not affect row hashes
+VOLATILE_COLUMNS = {'fetch_time', 'sequence', 'local_image_path', 'label_image_url', 'valid_until', '擷取時間', '資料來源URL'} | NUMERIC_COLUMNS
+
+
+def iter_csv_rows(file_paths):
+    """Stream rows from every CSV file in turn"""
+    for file_path in file_paths:
+        with open(file_path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def row_hash(row):
+    """Hash the non-volatile content of a row"""
+    content = '\x1f'.join(f"{k}={row[k]}" for k in sorted(row) if k and k not in VOLATILE_COLUMNS)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+
+def iter_registration_entries(data_dir):
+    """Registration rows keyed by permit number"""
+    for row in iter_csv_rows(dataset_files('registrations', data_dir)):
+        if row.get('data_type') != 'registration' or not row.get('permit_number'):
+            continue
+        yield 'registration', row['permit_number'], row_hash(row), {
+            'pesticide_code': row.get('pesticide_code', ''),
+            'registration_status': row.get('registration_status', ''),
+            'valid_date': row.get('valid_date', '')
+        }
+
+
+def iter_usage_range_entries(data_dir):
+    """Usage range rows keyed by pesticide + permit + crop + pest"""
+    file_paths = dataset_files('usage_ranges', data_dir) + dataset_files('permit_usage_ranges', data_dir)
+    for row in iter_csv_rows(file_paths):
+        key = '|'.join([
+            row.get('pesticide_code', ''),
+            row.get('permit_number', ''),
+            row.get('crop', ''),
+            row.get('pest_disease', ''),
+            row.get('dosage_per_hectare', ''),
+            row.get('dilution_ratio', '')
+        ])
+        yield 'usage_range', key, row_hash(row), {}
+
+
+def iter_crop_usage_entries(data_dir):
+    """PPM crop usage rows keyed by crop + pesticide, tracking the tolerance value"""
+    for row in iter_csv_rows(dataset_files('crop_usage', data_dir)):
+        pesticide_column = next((k for k in row if k and '藥劑' in k), None)
+        tolerance_column = next((k for k in row if k and '容許量' in k), None)
+        pest_column = next((k for k in row if k and ('病' in k or '蟲' in k or '害' in k) and k != pesticide_column), None)
+        key = '|'.join([
+            row.get('作物名稱', ''),
+            row.get(pest_column, '') if pest_column else '',
+            row.get(pesticide_column, '') if pesticide_column else ''
+        ])
+        yield 'crop_usage', key, row_hash(row), {
+            'tolerance': row.get(tolerance_column, '') if tolerance_column else ''
+        }
+
+
+def build_snapshot(data_dir):
+    """Build {dataset: {key: [hash, tracked fields]}} for the current data tree"""
+    snapshot = {}
+    sources = (iter_registration_entries, iter_usage_range_entries, iter_crop_usage_entries)
+    for source in sources:
+        for dataset, key, digest, tracked in source(data_dir):
+            entries = snapshot.setdefault(dataset, {})
+            # Disambiguate repeated keys by occurrence order
+            unique_key = key
+            occurrence = 1
+            while unique_key in entries:
+                occurrence += 1
+                unique_key = f"{key}#{occurrence}"
+            entries[unique_key] = [digest, tracked]
+    return snapshot
+
+
+def save_snapshot(snapshot, snapshot_dir, timestamp):
+    """Write a snapshot as one JSON line per entry"""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = os.path.join(snapshot_dir, f"{timestamp}.jsonl")
+    with open(snapshot_path, 'w', encoding='utf-8') as f:
+        for dataset, entries in snapshot.items():
+            for key, (digest, tracked) in entries.items():
+                f.write(json.dumps([dataset, key, digest, tracked], ensure_ascii=False) + '\n')
+    return snapshot_path
+
+
+def load_snapshot(snapshot_path):
+    """Load a snapshot written by save_snapshot"""
+    snapshot = {}
+    with open(snapshot_path, encoding='utf-8') as f:
+        for line in f:
+            dataset, key, digest, tracked = json.loads(line)
+            snapshot.setdefault(dataset, {})[key] = [digest, tracked]
+    return snapshot
+
+
+def latest_snapshot_path(snapshot_dir):
+    """Return the most recent snapshot file, or None"""
+    snapshots = sorted(glob.glob(os.path.join(snapshot_dir, '*.jsonl')))
+    return snapshots[-1] if snapshots else None
+
+
+def diff_snapshots(previous, current):
+    """Yield change records between two snapshots"""
+    for dataset in sorted(set(previous) | set(current)):
+        old_entries = previous.get(dataset, {})
+        new_entries = current.get(dataset, {})
+
+        for key, (digest, tracked) in new_entries.items():
+            old = old_entries.get(key)
+            if old is None:
+                yield {'dataset': dataset, 'key': key, 'change': 'added', 'values': tracked}
+                continue
+            if old[0] == digest:
+                continue
+
+            changed_fields = {
+                field: [old[1].get(field, ''), value]
+                for field, value in tracked.items()
+                if old[1].get(field, '') != value
+            }
+            change = 'changed'
+            status_change = changed_fields.get('registration_status')
+            if status_change and status_change[1] == 'expired':
+                change = 'revoked'
+            yield {'dataset': dataset, 'key': key, 'change': change, 'fields': changed_fields}
+
+        for key, (digest, tracked) in old_entries.items():
+            if key not in new_entries:
+                yield {'dataset': dataset, 'key': key, 'change': 'removed', 'values': tracked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot scraped data and report changes since the last run')
+    parser.add_argument('--data-dir', default='data',
+                        help='Root of the scraped data tree (default: data)')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR,
+                        help=f'Where snapshots are stored (default: {SNAPSHOT_DIR})')
+    parser.add_argument('--changes-dir', default=CHANGES_DIR,
+                        help=f'Where change sets are written (default: {CHANGES_DIR})')
+    parser.add_argument('--against',
+                        help='Compare against this snapshot file instead of the latest one')
+
+    args = parser.parse_args()
+
+    previous_path = args.against or latest_snapshot_path(args.snapshot_dir)
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    print("Building snapshot...")
+    current = build_snapshot(args.data_dir)
+    for dataset, entries in current.items():
+        print(f"  {dataset}: {len(entries)} rows")
+
+    snapshot_path = save_snapshot(current, args.snapshot_dir, timestamp)
+    print(f"Saved snapshot: {snapshot_path}")
+
+    if not previous_path:
+        print("No previous snapshot found - nothing to compare")
+        return
+
+    print(f"Comparing against: {previous_path}")
+    previous = load_snapshot(previous_path)
+
+    os.makedirs(args.changes_dir, exist_ok=True)
+    changes_path = os.path.join(args.changes_dir, f"{timestamp}.jsonl")
+    summary = {}
+    with open(changes_path, 'w', encoding='utf-8') as f:
+        for change in diff_snapshots(previous, current):
+            f.write(json.dumps(change, ensure_ascii=False) + '\n')
+            summary_key = (change['dataset'], change['change'])
+            summary[summary_key] = summary.get(summary_key, 0) + 1
+
+    print(f"\n=== Changes ===")
+    if not summary:
+        print("No changes")
+    for (dataset, change), count in sorted(summary.items()):
+        print(f"  {dataset} {change}: {count}")
+    print(f"Change set saved to: {changes_path}")
+
+
+if __name__ == '__main__':
+    main()
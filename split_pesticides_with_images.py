@@ -6,31 +6,68 @@ Image paths shown as: /path_to_image | date
 """
 
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
 import os
 import re
 import argparse
 import time
 from datetime import datetime
-from urllib.parse import urljoin, urlparse
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse, parse_qs
+
+from data_layout import COMPREHENSIVE_DATA_PATH, PESTICIDE_LIST_PATH, REGULATORY_DIR, STATE_DIR
+from expiry_index import to_iso_dates
+from image_downloader import AsyncImageDownloader, ImageQueueConsumer, IMAGE_JOB_KIND
+from job_queue import SQLiteJobQueue, read_job_counts
+from numeric_fields import REGISTRATION_NUMERIC_FIELDS, USAGE_NUMERIC_FIELDS, add_numeric_columns
+from page_archive import PageArchive
+from records import ColumnBatch, Registration, UsageRange, categorize, records_to_frame
+from run_planner import plan_pesticide_run
+from scraper_core import HttpClient, pesticide_dir, pesticide_file, write_csv, write_json_atomic
+
+IMAGE_QUEUE_PATH = os.path.join(STATE_DIR, 'image_jobs.sqlite')
+USAGE_CACHE_DIR = 'data/cache/usage_range'
+USAGE_CACHE_TTL = 24 * 3600  # seconds before a cached per-permit usage range is fetched again
+
+
+def permit_ids(permit_number):
+    """Registration type and number used by the label pages, e.g. 農藥進 01196 -> ('11', '01196')"""
+    regtid = '10'  # Default registration type
+    regtno = permit_number.replace('農藥製', '').replace('農藥進', '').replace('農藥原進', '').strip()
+    
+    # Clean up permit number format
+    if '農藥製' in permit_number:
+        regtid = '10'
+    elif '農藥進' in permit_number:
+        regtid = '11'
+    elif '農藥原進' in permit_number:
+        regtid = '12'
+    return regtid, regtno
+
 
 class PesticideSplitter:
-    def __init__(self):
-        self.session = requests.Session()
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8',
-            'Referer': 'https://pesticide.aphia.gov.tw/'
-        }
-        self.session.headers.update(self.headers)
+    def __init__(self, image_workers=4, image_queue=None, per_permit_usage=False, usage_workers=4, http=None,
+                 usage_cache_dir=USAGE_CACHE_DIR, usage_cache_ttl=USAGE_CACHE_TTL):
+        self.http = http or HttpClient(headers={'Referer': 'https://pesticide.aphia.gov.tw/'})
+        self.session = self.http.session
+        self.headers = self.http.headers
         self.base_url = "https://pesticide.aphia.gov.tw"
+        self.image_workers = image_workers
+        self.image_queue = image_queue  # When set, label images are queued instead of downloaded inline
+        self.per_permit_usage = per_permit_usage
+        self.usage_workers = usage_workers
+        self.usage_cache = {}
+        self.usage_cache_lock = threading.Lock()
+        self.usage_cache_dir = usage_cache_dir  # None disables the on-disk usage range cache
+        self.usage_cache_ttl = usage_cache_ttl  # 0 or less always refetches
         
     def establish_session(self):
         """Establish session with Taiwan pesticide database"""
         try:
-            response = self.session.get(f"{self.base_url}/information/Query/Pesticide")
+            response = self.http.get(f"{self.base_url}/information/Query/Pesticide")
             return response.status_code == 200
         except:
             return False
@@ -45,7 +82,7 @@ class PesticideSplitter:
         }
         
         try:
-            response = self.session.get(url, params=params)
+            response = self.http.get(url, params=params)
             if response.status_code != 200:
                 return []
             
@@ -71,16 +108,7 @@ class PesticideSplitter:
                     permit_number = permit_link.get_text(strip=True) if permit_link else cells[0].get_text(strip=True)
                     
                     # Extract regtid and regtno for image URL construction
-                    regtid = '10'  # Default registration type
-                    regtno = permit_number.replace('農藥製', '').replace('農藥進', '').replace('農藥原進', '').strip()
-                    
-                    # Clean up permit number format
-                    if '農藥製' in permit_number:
-                        regtid = '10'
-                    elif '農藥進' in permit_number:
-                        regtid = '11'
-                    elif '農藥原進' in permit_number:
-                        regtid = '12'
+                    regtid, regtno = permit_ids(permit_number)
                     
                     # Construct image view URL
                     image_view_url = f"{self.base_url}/information/Query/RegisterViewMark/?regtid={regtid}&regtno={regtno}"
@@ -97,23 +125,35 @@ class PesticideSplitter:
                     valid_date = cells[9].get_text(strip=True)
                     remarks = cells[10].get_text(separator='\\n', strip=True) if len(cells) > 10 else ''
                     
-                    registration = {
-                        'permit_number': permit_number,
-                        'regtid': regtid,
-                        'regtno': regtno,
-                        'pesticide_name': pest_name,
-                        'brand_name': brand_name,
-                        'formulation_type': formulation,
-                        'concentration': concentration,
-                        'up_status': up_status,
-                        'mixture': mixture,
-                        'manufacturer': manufacturer,
-                        'foreign_manufacturer': foreign_mfg,
-                        'valid_date': valid_date,
-                        'remarks': remarks,
-                        'image_view_url': image_view_url,
-                        'label_image_url': ''  # Will be populated by get_image_download_url
-                    }
+                    # Extract per-permit usage range query parameters from the 使用範圍 link
+                    usage_params = {}
+                    for link in row.find_all('a', href=True):
+                        href = link.get('href', '')
+                        if 'Userange' in href:
+                            query = parse_qs(urlparse(href).query, keep_blank_values=True)
+                            usage_params = {key: values[0] for key, values in query.items()}
+                            break
+                    
+                    registration = Registration(
+                        permit_number=permit_number,
+                        regtid=regtid,
+                        regtno=regtno,
+                        pesticide_name=pest_name,
+                        brand_name=brand_name,
+                        formulation_type=formulation,
+                        concentration=concentration,
+                        up_status=up_status,
+                        mixture=mixture,
+                        manufacturer=manufacturer,
+                        foreign_manufacturer=foreign_mfg,
+                        valid_date=valid_date,
+                        remarks=remarks,
+                        image_view_url=image_view_url,
+                        label_image_url='',  # Will be populated by get_image_download_url
+                        cidecd=usage_params.get('cidecd', ''),
+                        pescnt=usage_params.get('pescnt', ''),
+                        compno=usage_params.get('compno', '')
+                    )
                     registrations.append(registration)
             
             return registrations
@@ -128,7 +168,7 @@ class PesticideSplitter:
             view_url = f"{self.base_url}/information/Query/RegisterViewMark/"
             params = {'regtid': regtid, 'regtno': regtno}
             
-            response = self.session.get(view_url, params=params)
+            response = self.http.get(view_url, params=params)
             if response.status_code != 200:
                 return None
             
@@ -159,7 +199,7 @@ class PesticideSplitter:
             return None
     
     def fetch_usage_range_data(self, pestcd, cidecd, pescnt, compno, regtid, regtno):
-        """Fetch usage range data from /UserangeList/ endpoint"""
+        """Fetch usage range data from /UserangeList/ endpoint into a UsageRange column batch"""
         try:
             # Use the correct endpoint that loads the actual data
             url = f"{self.base_url}/information/Query/UserangeList/"
@@ -188,20 +228,17 @@ class PesticideSplitter:
             headers['X-Requested-With'] = 'XMLHttpRequest'
             headers['Referer'] = f'{self.base_url}/information/Query/Userange/?pestcd={pestcd}&newquery=true'
             
-            response = self.session.get(url, params=params, headers=headers)
+            response = self.http.get(url, params=params, headers=headers)
             print(f"      Request URL: {response.url}")
             if response.status_code != 200:
                 print(f"      Error fetching usage range: HTTP {response.status_code}")
-                return []
+                return ColumnBatch(UsageRange)
             
             soup = BeautifulSoup(response.text, 'html.parser')
             
             # Find all tables (there can be multiple tables for different formulations)
             tables = soup.find_all('table')
-            if not tables:
-                return []
-            
-            usage_ranges = []
+            usage_ranges = ColumnBatch(UsageRange)
             
             for table in tables:
                 rows = table.find_all('tr')
@@ -212,28 +249,16 @@ class PesticideSplitter:
                 for row in rows[1:]:
                     cells = row.find_all('td')
                     if len(cells) >= 12:  # Ensure we have enough columns
-                        usage_range = {
-                            'crop': cells[0].get_text(strip=True),
-                            'pest_disease': cells[1].get_text(strip=True),
-                            'dosage_per_hectare': cells[2].get_text(strip=True),
-                            'dilution_ratio': cells[3].get_text(strip=True),
-                            'application_timing': cells[4].get_text(strip=True),
-                            'application_interval': cells[5].get_text(strip=True),
-                            'max_applications': cells[6].get_text(strip=True),
-                            'pre_harvest_interval': cells[7].get_text(strip=True),
-                            'application_method': cells[8].get_text(strip=True),
-                            'precautions': cells[9].get_text(strip=True),
-                            'notes': cells[10].get_text(strip=True),
-                            'approval_date': cells[11].get_text(strip=True) if len(cells) > 11 else '',
-                            'original_registrar': cells[12].get_text(strip=True) if len(cells) > 12 else ''
-                        }
-                        usage_ranges.append(usage_range)
+                        # Append straight into the column buffers in UsageRange field order
+                        texts = [cell.get_text(strip=True) for cell in cells[:13]]
+                        texts.extend([''] * (13 - len(texts)))
+                        usage_ranges.append(*texts)
             
             return usage_ranges
             
         except Exception as e:
             print(f"      Error fetching usage range data: {e}")
-            return []
+            return ColumnBatch(UsageRange)
     
     def download_pesticide_image(self, image_url, pest_code, pest_name, permit_number, download_date):
         """Download and organize pesticide label image"""
@@ -242,9 +267,7 @@ class PesticideSplitter:
             
         try:
             # Create unified pesticide directory for all files
-            safe_pest_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', pest_name)
-            folder_name = f"{pest_code}_{safe_pest_name}"
-            pest_dir = f"data/pesticides/{folder_name}"
+            pest_dir = pesticide_dir(pest_code, pest_name)
             labels_dir = f"{pest_dir}/labels"
             os.makedirs(labels_dir, exist_ok=True)
             
@@ -258,8 +281,8 @@ class PesticideSplitter:
             
             print(f"    Downloading image: {full_url}")
             
-            # Download image
-            response = self.session.get(full_url)
+            # Download image (streamed so large labels are never held in memory)
+            response = self.http.get(full_url, stream=True)
             if response.status_code == 200:
                 # Extract filename from URL
                 if 'url=' in image_url:
@@ -284,23 +307,115 @@ class PesticideSplitter:
                 
                 file_path = os.path.join(labels_dir, safe_filename)
                 
-                # Save image
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
+                # Save image in chunks to a temporary file, then move into place
+                temp_path = f"{file_path}.part"
+                bytes_written = 0
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if chunk:
+                            f.write(chunk)
+                            bytes_written += len(chunk)
+                os.replace(temp_path, file_path)
                 
-                print(f"    Saved image: {file_path} ({len(response.content)} bytes)")
+                print(f"    Saved image: {file_path} ({bytes_written} bytes)")
                 
                 # Return path in requested format: /absolute_path_to_image | date
                 abs_path = os.path.abspath(file_path)
                 return f"{abs_path} | {download_date}"
             else:
                 print(f"    Failed to download image: HTTP {response.status_code}")
+                response.close()
             
         except Exception as e:
             print(f"    Error downloading image {image_url}: {e}")
         
         return None
     
+    def fetch_usage_range_cached(self, query):
+        """Fetch usage ranges for one (pestcd, cidecd, pescnt, compno, regtid, regtno) query
+        
+        Results are cached for usage_cache_ttl seconds under the full query.
+        """
+        usage_key = tuple(query)
+        now = time.time()
+        with self.usage_cache_lock:
+            cached = self.usage_cache.get(usage_key)
+            if cached and now - cached[0] < self.usage_cache_ttl:
+                return cached[1]
+        
+        # Check on-disk cache from previous runs
+        cache_name = hashlib.sha1('|'.join(usage_key).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(self.usage_cache_dir, f"{cache_name}.json") if self.usage_cache_dir else None
+        if cache_path and os.path.exists(cache_path) and now - os.path.getmtime(cache_path) < self.usage_cache_ttl:
+            fetched_at = os.path.getmtime(cache_path)
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                usage_ranges = ColumnBatch(UsageRange, json.load(f))
+        else:
+            fetched_at = now
+            usage_ranges = self.fetch_usage_range_data(*query)
+            if usage_ranges and cache_path:
+                write_json_atomic(cache_path, usage_ranges.columns)
+        
+        with self.usage_cache_lock:
+            self.usage_cache[usage_key] = (fetched_at, usage_ranges)
+        return usage_ranges
+    
+    def create_permit_usage_range_csv(self, pest_code, pest_name, registrations):
+        """Create permit-level usage range CSV by querying UserangeList for every registration"""
+        # Group registrations by their full query so identical queries are only made once
+        permits_by_key = {}
+        for registration in registrations:
+            if not (registration.compno and registration.regtid and registration.regtno):
+                continue
+            usage_key = (pest_code, registration.cidecd, registration.pescnt, registration.compno,
+                         registration.regtid, registration.regtno)
+            permits_by_key.setdefault(usage_key, []).append(registration)
+        queries = list(permits_by_key)
+        
+        if not permits_by_key:
+            print(f"    No per-permit usage parameters found for {pest_code}")
+            return None
+        
+        print(f"    Fetching per-permit usage range with {len(queries)} queries...")
+        self.http.ensure_pool(self.usage_workers)
+        with ThreadPoolExecutor(max_workers=self.usage_workers) as executor:
+            results = dict(zip(permits_by_key, executor.map(self.fetch_usage_range_cached, queries)))
+        
+        current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        permit_frames = []
+        for usage_key, permit_registrations in permits_by_key.items():
+            usage_ranges = results[usage_key]
+            if not usage_ranges:
+                continue
+            for registration in permit_registrations:
+                permit_frames.append(usage_ranges.to_frame(
+                    pesticide_code=pest_code,
+                    pesticide_name=pest_name,
+                    permit_number=registration.permit_number,
+                    brand_name=registration.brand_name,
+                    formulation_type=registration.formulation_type,
+                    concentration=registration.concentration,
+                    manufacturer=registration.manufacturer,
+                    data_source='Taiwan Pesticide Database - Permit Usage Range',
+                    fetch_time=current_date
+                ))
+        
+        if not permit_frames:
+            print(f"    No per-permit usage range data found for {pest_code}")
+            return None
+        
+        df = add_numeric_columns(categorize(pd.concat(permit_frames, ignore_index=True)), USAGE_NUMERIC_FIELDS)
+        csv_path = pesticide_file(pest_code, pest_name, '_permit_usage_range')
+        write_csv(df, csv_path)
+        
+        print(f"    Saved permit usage range CSV: {csv_path} ({len(df)} records)")
+        
+        return {
+            'csv_path': csv_path,
+            'permit_usage_count': len(df),
+            'query_count': len(permits_by_key)
+        }
+    
     def create_usage_range_csv(self, pest_code, pest_data):
         """Create usage range CSV for one pesticide"""
         try:
@@ -319,14 +434,12 @@ class PesticideSplitter:
             # Remove duplicates based on permit number
             unique_registrations = {}
             for reg in all_registrations:
-                permit_num = reg.get('permit_number', '')
+                permit_num = reg.permit_number
                 if permit_num and permit_num not in unique_registrations:
                     unique_registrations[permit_num] = reg
             
             registrations = list(unique_registrations.values())
             
-            # Collect all usage range data
-            all_usage_ranges = []
             current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
             # First, get general usage range for the pesticide (all formulations)
@@ -342,67 +455,59 @@ class PesticideSplitter:
             
             print(f"      Found {len(general_usage_ranges)} general usage records")
             
-            # Process and add registration context to usage ranges
-            for usage_range in general_usage_ranges:
-                # For general usage, we'll match with registrations based on formulation/concentration
-                usage_range.update({
-                    'pesticide_code': pest_code,
-                    'pesticide_name': pest_name,
-                    'permit_number': 'General',  # General usage not tied to specific permit
-                    'brand_name': 'Various',
-                    'formulation_type': 'Various',
-                    'concentration': 'Various',
-                    'manufacturer': 'Various',
-                    'data_source': 'Taiwan Pesticide Database - Usage Range',
-                    'fetch_time': current_date
-                })
-            
-            all_usage_ranges.extend(general_usage_ranges)
-            
-            # Optionally, also get specific registration usage (commented out to avoid redundancy)
-            # for registration in registrations[:5]:  # Limit to first 5 to avoid too many requests
-            #     ... specific registration code ...
-            
-            if not all_usage_ranges:
-                print(f"    No usage range data found for {pest_code}")
-                return None
+            # Add registration context to usage ranges as constant columns
+            # For general usage, we'll match with registrations based on formulation/concentration
+            df = general_usage_ranges.to_frame(
+                pesticide_code=pest_code,
+                pesticide_name=pest_name,
+                permit_number='General',  # General usage not tied to specific permit
+                brand_name='Various',
+                formulation_type='Various',
+                concentration='Various',
+                manufacturer='Various',
+                data_source='Taiwan Pesticide Database - Usage Range',
+                fetch_time=current_date
+            )
             
-            # Create DataFrame
-            df = pd.DataFrame(all_usage_ranges)
+            # Optionally, also get specific registration usage as a separate permit-level table
+            permit_result = None
+            if self.per_permit_usage:
+                permit_result = self.create_permit_usage_range_csv(pest_code, pest_name, registrations)
             
-            # Create pesticide-specific directory
-            safe_pest_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', pest_name)
-            folder_name = f"{pest_code}_{safe_pest_name}"
-            pest_dir = f"data/pesticides/{folder_name}"
-            os.makedirs(pest_dir, exist_ok=True)
+            permit_usage_count = permit_result['permit_usage_count'] if permit_result else 0
+            if df.empty:
+                print(f"    No usage range data found for {pest_code}")
+                if not permit_result:
+                    return None
+                # The per-permit CSV was still written, so report it
+                return {
+                    'csv_path': permit_result['csv_path'],
+                    'usage_range_count': 0,
+                    'registration_count': len(registrations),
+                    'permit_usage_count': permit_usage_count
+                }
             
-            # Save usage range CSV
-            csv_filename = f"{pest_code}_{safe_pest_name}_usage_range.csv"
-            csv_path = os.path.join(pest_dir, csv_filename)
+            add_numeric_columns(df, USAGE_NUMERIC_FIELDS)
             
-            df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+            # Save usage range CSV in the pesticide-specific directory
+            csv_path = pesticide_file(pest_code, pest_name, '_usage_range')
+            write_csv(df, csv_path)
             
-            print(f"    Saved usage range CSV: {csv_path} ({len(all_usage_ranges)} records)")
+            print(f"    Saved usage range CSV: {csv_path} ({len(df)} records)")
             
             return {
                 'csv_path': csv_path,
-                'usage_range_count': len(all_usage_ranges),
-                'registration_count': len(registrations)
+                'usage_range_count': len(df),
+                'registration_count': len(registrations),
+                'permit_usage_count': permit_usage_count
             }
             
         except Exception as e:
             print(f"    Error creating usage range CSV for {pest_code}: {e}")
             return None
     
-    def create_pesticide_csv(self, pest_code, pest_data, download_images=True):
-        """Create individual CSV for one pesticide with all its data"""
-        
-        # Get basic pesticide info
-        basic_info = pest_data['basic_info']
-        pest_name = basic_info['pesticide_name']
-        
-        print(f"  Creating CSV for {pest_code}: {pest_name}")
-        
+    def collect_registrations(self, pest_code, pest_data):
+        """Fresh registrations for one pesticide merged with known ones, unique by permit number"""
         # Get fresh registration data with images
         fresh_registrations = self.fetch_registration_data_with_images(pest_code)
         
@@ -412,11 +517,32 @@ class PesticideSplitter:
         # Remove duplicates based on permit number
         unique_registrations = {}
         for reg in all_registrations:
-            permit_num = reg.get('permit_number', '')
+            permit_num = reg.permit_number
             if permit_num and permit_num not in unique_registrations:
                 unique_registrations[permit_num] = reg
         
-        registrations = list(unique_registrations.values())
+        return list(unique_registrations.values())
+    
+    def create_pesticide_csv(self, pest_code, pest_data, download_images=True, known_image_paths=None,
+                             known_image_urls=None, registrations=None):
+        """Create individual CSV for one pesticide with all its data
+        
+        known_image_paths / known_image_urls ({permit number: value}) carry label
+        results over from an earlier run when images are not downloaded again.
+        registrations, when given, are used instead of fetching them here.
+        """
+        
+        # Get basic pesticide info
+        basic_info = pest_data['basic_info']
+        pest_name = basic_info['pesticide_name']
+        
+        print(f"  Creating CSV for {pest_code}: {pest_name}")
+        
+        if registrations is None:
+            registrations = self.collect_registrations(pest_code, pest_data)
+        for registration in registrations:
+            if not registration.label_image_url and known_image_urls:
+                registration.label_image_url = known_image_urls.get(registration.permit_number, '')
         
         # Create comprehensive records for this pesticide
         pesticide_records = []
@@ -435,77 +561,91 @@ class PesticideSplitter:
         }
         pesticide_records.append(base_record)
         
-        # Add registration records with images
-        for i, registration in enumerate(registrations, 1):
-            # Get image download URL and download if available
-            image_path_with_date = ''
-            if download_images:
-                # First try to get the actual image download URL
-                if registration.get('regtid') and registration.get('regtno'):
-                    image_download_url = self.get_image_download_url(
-                        registration['regtid'], 
-                        registration['regtno']
-                    )
-                    registration['label_image_url'] = image_download_url
-                    
-                    if image_download_url:
-                        image_path_with_date = self.download_pesticide_image(
-                            image_download_url,
-                            pest_code,
-                            pest_name,
-                            registration['permit_number'],
-                            current_date.split()[0]  # Just the date part
-                        )
-            
-            reg_record = {
-                'data_type': 'registration',
-                'sequence': i,
-                'pesticide_code': pest_code,
-                'pesticide_name': pest_name,
-                'permit_number': registration['permit_number'],
-                'brand_name': registration['brand_name'],
-                'formulation_type': registration['formulation_type'],
-                'concentration': registration['concentration'],
-                'up_status': registration.get('up_status', ''),
-                'mixture': registration.get('mixture', ''),
-                'manufacturer': registration['manufacturer'],
-                'foreign_manufacturer': registration.get('foreign_manufacturer', ''),
-                'valid_date': registration['valid_date'],
-                'remarks': registration.get('remarks', ''),
-                'label_image_url': registration.get('label_image_url', ''),
-                'local_image_path': image_path_with_date,
-                'registration_status': 'active' if '廢止' not in str(registration.get('remarks', '')) else 'expired',
-                'data_source': 'Taiwan Pesticide Database',
-                'fetch_time': current_date
-            }
-            pesticide_records.append(reg_record)
-        
-        # Create DataFrame and save
-        df = pd.DataFrame(pesticide_records)
+        # Resolve and download label images concurrently
+        image_paths = dict(known_image_paths or {})
+        if download_images and self.image_queue is None:
+            downloader = AsyncImageDownloader(self, concurrency=self.image_workers)
+            image_paths = downloader.download_all(
+                registrations,
+                pest_code,
+                pest_name,
+                current_date.split()[0]  # Just the date part
+            )
         
-        # Create pesticide-specific directory with full name
-        safe_pest_name = re.sub(r'[^\w\-_\u4e00-\u9fff]', '_', pest_name)
-        folder_name = f"{pest_code}_{safe_pest_name}"
-        pest_dir = f"data/pesticides/{folder_name}"
-        os.makedirs(pest_dir, exist_ok=True)
+        # Add registration records with images, built column by column
+        reg_columns = records_to_frame(registrations, Registration)
+        reg_df = pd.DataFrame({
+            'data_type': 'registration',
+            'sequence': range(1, len(registrations) + 1),
+            'pesticide_code': pest_code,
+            'pesticide_name': pest_name,
+            'permit_number': reg_columns['permit_number'],
+            'brand_name': reg_columns['brand_name'],
+            'formulation_type': reg_columns['formulation_type'],
+            'concentration': reg_columns['concentration'],
+            'up_status': reg_columns['up_status'],
+            'mixture': reg_columns['mixture'],
+            'manufacturer': reg_columns['manufacturer'],
+            'foreign_manufacturer': reg_columns['foreign_manufacturer'],
+            'valid_date': reg_columns['valid_date'],
+            'valid_until': to_iso_dates(reg_columns['valid_date']).to_numpy(),
+            'remarks': reg_columns['remarks'],
+            'label_image_url': reg_columns['label_image_url'].fillna(''),
+            'local_image_path': reg_columns['permit_number'].map(image_paths).fillna(''),
+            'registration_status': reg_columns['remarks'].astype(str).str.contains('廢止', regex=False).map(
+                {True: 'expired', False: 'active'}
+            ),
+            'data_source': 'Taiwan Pesticide Database',
+            'fetch_time': current_date
+        })
+        add_numeric_columns(reg_df, REGISTRATION_NUMERIC_FIELDS)
+        df = pd.concat([pd.DataFrame(pesticide_records), reg_df], ignore_index=True)
         
-        # Save CSV
-        csv_filename = f"{pest_code}_{safe_pest_name}.csv"
-        csv_path = os.path.join(pest_dir, csv_filename)
+        # Save CSV in the pesticide-specific directory with full name
+        csv_path = pesticide_file(pest_code, pest_name)
+        write_csv(df, csv_path)
         
-        df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+        # Hand label images to the background queue now that the tabular data is saved
+        queued_images = 0
+        if download_images and self.image_queue is not None:
+            manifest_path = pesticide_file(pest_code, pest_name, '_labels')
+            queued_images = self.enqueue_image_jobs(
+                registrations, pest_code, pest_name, current_date.split()[0], manifest_path
+            )
+            print(f"    Queued {queued_images} label image jobs")
         
         return {
             'csv_path': csv_path,
-            'record_count': len(pesticide_records),
+            'record_count': len(df),
             'registration_count': len(registrations),
-            'image_count': len([r for r in pesticide_records if r.get('local_image_path')])
+            'image_count': int((reg_df['local_image_path'] != '').sum()),
+            'queued_image_count': queued_images
         }
     
+    def enqueue_image_jobs(self, registrations, pest_code, pest_name, download_date, manifest_path):
+        """Emit one label image job per registration onto the persistent image queue"""
+        queued = 0
+        for registration in registrations:
+            if not (registration.regtid and registration.regtno):
+                continue
+            
+            self.image_queue.enqueue(IMAGE_JOB_KIND, registration.permit_number, {
+                'regtid': registration.regtid,
+                'regtno': registration.regtno,
+                'permit_number': registration.permit_number,
+                'pest_code': pest_code,
+                'pest_name': pest_name,
+                'download_date': download_date,
+                'manifest_path': manifest_path
+            })
+            queued += 1
+        
+        return queued
+    
     def fetch_pesticide_list(self):
         """Fetch complete pesticide list from Taiwan pesticide database API"""
         try:
-            os.makedirs('data/regulatory', exist_ok=True)
+            os.makedirs(REGULATORY_DIR, exist_ok=True)
             
             print("Fetching complete pesticide list from government database...")
             
@@ -521,7 +661,7 @@ class PesticideSplitter:
                     'pagesize': page_size
                 }
                 
-                response = self.session.get(list_url, params=params)
+                response = self.http.get(list_url, params=params)
                 
                 if response.status_code != 200:
                     print(f"Error fetching page {page}: HTTP {response.status_code}")
@@ -581,8 +721,7 @@ class PesticideSplitter:
             
             # Create DataFrame and save
             df = pd.DataFrame(pesticides)
-            csv_path = 'data/regulatory/taiwan_pesticide_list.csv'
-            df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+            write_csv(df, PESTICIDE_LIST_PATH)
             
             print(f"Successfully fetched {len(pesticides)} pesticides from government database")
             return df
@@ -596,7 +735,7 @@ class PesticideSplitter:
         try:
             # Try to load existing pesticide list
             try:
-                pesticide_list = pd.read_csv('data/regulatory/taiwan_pesticide_list.csv')
+                pesticide_list = pd.read_csv(PESTICIDE_LIST_PATH)
             except FileNotFoundError:
                 # If file doesn't exist, fetch it
                 pesticide_list = self.fetch_pesticide_list()
@@ -605,7 +744,7 @@ class PesticideSplitter:
             
             # Load existing comprehensive data if available
             try:
-                comprehensive_data = pd.read_csv('data/regulatory/taiwan_comprehensive_combined.csv')
+                comprehensive_data = pd.read_csv(COMPREHENSIVE_DATA_PATH)
             except FileNotFoundError:
                 comprehensive_data = pd.DataFrame()
             
@@ -633,15 +772,15 @@ class PesticideSplitter:
                     ]
                     
                     for _, reg_row in pest_regs.iterrows():
-                        registrations.append({
-                            'permit_number': reg_row.get('permit_number', ''),
-                            'brand_name': reg_row.get('brand_name', ''),
-                            'formulation_type': reg_row.get('formulation_type', ''),
-                            'concentration': reg_row.get('concentration', ''),
-                            'manufacturer': reg_row.get('manufacturer', ''),
-                            'valid_date': reg_row.get('valid_date', ''),
-                            'remarks': reg_row.get('remarks', '')
-                        })
+                        registrations.append(Registration(
+                            permit_number=reg_row.get('permit_number', ''),
+                            brand_name=reg_row.get('brand_name', ''),
+                            formulation_type=reg_row.get('formulation_type', ''),
+                            concentration=reg_row.get('concentration', ''),
+                            manufacturer=reg_row.get('manufacturer', ''),
+                            valid_date=reg_row.get('valid_date', ''),
+                            remarks=reg_row.get('remarks', '')
+                        ))
                 
                 pesticide_data[pest_code] = {
                     'basic_info': basic_info,
@@ -666,17 +805,65 @@ def main():
                         help='Only download images, skip if CSV already exists')
     parser.add_argument('--usage-range-only', action='store_true',
                         help='Only create usage range CSV files')
+    parser.add_argument('--image-workers', type=int, default=4,
+                        help='Number of concurrent label image downloads (default: 4)')
+    parser.add_argument('--per-permit-usage', action='store_true',
+                        help='Also fetch usage ranges for every registration into *_permit_usage_range.csv')
+    parser.add_argument('--usage-workers', type=int, default=4,
+                        help='Number of concurrent per-permit usage range requests (default: 4)')
+    parser.add_argument('--usage-cache-hours', type=float, default=USAGE_CACHE_TTL / 3600,
+                        help='Reuse cached per-permit usage ranges younger than this many hours; 0 always refetches (default: 24)')
+    parser.add_argument('--defer-images', action='store_true',
+                        help='Queue label images for a background consumer instead of downloading inline')
+    parser.add_argument('--drain-images', action='store_true',
+                        help='Only run the image consumer pool until the image queue is empty')
+    parser.add_argument('--archive', action='store_true',
+                        help='Archive every fetched page to data/archive for offline re-parsing')
+    parser.add_argument('--plan', action='store_true',
+                        help='Estimate requests, images, bytes and time for this run without fetching anything')
     
     args = parser.parse_args()
     
     print("=== Taiwan Pesticide Data Splitter with Images ===")
     
-    # Initialize splitter
-    splitter = PesticideSplitter()
+    # Initialize splitter; a plan never opens the queue, which would create or migrate it
+    use_queue = (args.defer_images or args.drain_images) and not args.plan
+    image_queue = SQLiteJobQueue(IMAGE_QUEUE_PATH) if use_queue else None
+    splitter = PesticideSplitter(
+        image_workers=args.image_workers,
+        image_queue=image_queue,
+        per_permit_usage=args.per_permit_usage,
+        usage_workers=args.usage_workers,
+        usage_cache_ttl=args.usage_cache_hours * 3600
+    )
+    if args.archive:
+        splitter.http.add_response_hook(PageArchive().hook)
     
-    print("Establishing session...")
-    if not splitter.establish_session():
-        print("Warning: Could not establish session. Image download may fail.")
+    if args.drain_images and args.plan:
+        counts = read_job_counts(IMAGE_QUEUE_PATH, IMAGE_JOB_KIND)
+        print(f"Mode: Plan only, image queue {IMAGE_QUEUE_PATH} is not drained")
+        print(f"Pending image jobs: {counts.get('pending', 0)} (leased: {counts.get('leased', 0)})")
+        print(f"Queue status: {counts}")
+        return
+    
+    if args.plan and not os.path.exists(PESTICIDE_LIST_PATH):
+        print(f"No cached pesticide list at {PESTICIDE_LIST_PATH} - run once without --plan to fetch it")
+        return
+    
+    if not args.plan:
+        print("Establishing session...")
+        if not splitter.establish_session():
+            print("Warning: Could not establish session. Image download may fail.")
+    
+    if args.drain_images:
+        print(f"Mode: Draining image queue {IMAGE_QUEUE_PATH} with {args.image_workers} workers")
+        consumer = ImageQueueConsumer(splitter, image_queue, concurrency=args.image_workers)
+        stats = consumer.drain()
+        print(f"\n=== Image Queue Drained ===")
+        print(f"Images completed: {stats['done']}")
+        print(f"Failed attempts: {stats['failed']}")
+        print(f"Queue status: {image_queue.counts(IMAGE_JOB_KIND)}")
+        return
     
     # Load pesticide data
     print("Loading pesticide data...")
@@ -701,6 +888,18 @@ def main():
     
     # Process each pesticide
     download_images = not args.no_images
+    
+    if args.plan:
+        plan_pesticide_run(
+            list(pesticides_to_process),
+            download_images=download_images,
+            usage_range_only=args.usage_range_only,
+            per_permit_usage=args.per_permit_usage,
+            defer_images=args.defer_images,
+            image_workers=args.image_workers,
+            usage_workers=args.usage_workers
+        ).print()
+        return
     results = []
     usage_range_results = []
     
@@ -731,7 +930,7 @@ def main():
             
             try:
                 # Check if CSV already exists and we're in images-only mode
-                pest_dir = f"data/pesticides/{pest_code}"
+                pest_dir = pesticide_dir(pest_code, pest_data['basic_info']['pesticide_name'])
                 if args.images_only and os.path.exists(pest_dir):
                     csv_files = [f for f in os.listdir(pest_dir) if f.endswith('.csv')]
                     if csv_files:
@@ -764,6 +963,10 @@ def main():
             
             print(f"Total usage range records: {total_usage_ranges}")
             print(f"Total registrations processed: {total_registrations}")
+            
+            total_permit_usage = sum(r.get('permit_usage_count', 0) for r in usage_range_results)
+            if total_permit_usage:
+                print(f"Total permit-level usage records: {total_permit_usage}")
             print(f"Usage range data saved to: data/pesticides/[CODE_NAME]/[CODE_NAME]_usage_range.csv")
             
             # Show sample results
@@ -784,6 +987,10 @@ def main():
             print(f"Total registrations: {total_registrations}")
             print(f"Total images downloaded: {total_images}")
             
+            total_queued = sum(r.get('queued_image_count', 0) for r in results)
+            if total_queued:
+                print(f"Total images queued: {total_queued} (run with --drain-images to download)")
+            
             if usage_range_results:
                 total_usage_ranges = sum(r['usage_range_count'] for r in usage_range_results)
                 print(f"Total usage range records: {total_usage_ranges}")
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Cross-source join of PPM crop usage and APHIA usage ranges
+Normalizes pesticide, crop and pest names, builds hash indexes over the
+APHIA usage ranges and streams every PPM crop row through them once,
+writing one merged usage table with match-quality flags
+"""
+
+import argparse
+import csv
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+from data_layout import PESTICIDE_LIST_PATH, dataset_files, in_data_dir
+from export import EXPORT_DIR
+
+PPM_FIELDS = ['ppm_pesticide', 'ppm_crop', 'ppm_pest', 'ppm_tolerance', 'ppm_dilution', 'ppm_phi', 'ppm_source_file']
+APHIA_FIELDS = ['aphia_crop', 'aphia_pest_disease', 'aphia_dosage_per_hectare', 'aphia_dilution_ratio',
+                'aphia_pre_harvest_interval', 'aphia_application_method', 'aphia_source_file']
+OUTPUT_COLUMNS = (['pesticide_code', 'pesticide_name', 'source', 'match_quality',
+                   'pesticide_match', 'crop_match', 'pest_match'] + PPM_FIELDS + APHIA_FIELDS)
+
+
+# Separators between the entries of a pest list such as '葉稻熱病、穗稻熱病' (after NFKC)
+LIST_SEPARATORS = re.compile(r'[\s,、;/及]+')
+
+
+@lru_cache(maxsize=None)
+def normalize_name(text):
+    """Full-width to half-width, drop whitespace, bracketed notes and punctuation, lowercase"""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    text = re.sub(r'[(\[（【].*?[)\]）】]', '', text)
+    return re.sub(r'[\s,，、.·\-_/]+', '', text)
+
+
+@lru_cache(maxsize=None)
+def name_tokens(text):
+    """Normalized entries of a name list, e.g. '葉稻熱病、穗稻熱病' -> {'葉稻熱病', '穗稻熱病'}"""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    text = re.sub(r'[(\[（【].*?[)\]）】]', '', text)
+    return frozenset(filter(None, (normalize_name(part) for part in LIST_SEPARATORS.split(text))))
+
+
+@lru_cache(maxsize=None)
+def chinese_part(text):
+    """Only the CJK characters of a normalized name, e.g. 三亞蟎amitraz -> 三亞蟎"""
+    return ''.join(ch for ch in text if '一' <= ch <= '鿿')
+
+
+def read_rows(file_path):
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def find_column(columns, keywords, exclude=()):
+    """First column whose name contains any of the keywords"""
+    for column in columns:
+        if column and column not in exclude and any(keyword in column for keyword in keywords):
+            return column
+    return None
+
+
+class PesticideNames:
+    """Resolve free-text pesticide names to codes"""
+
+    def __init__(self):
+        self.codes = {}  # normalized name -> code
+        self.names = {}  # code -> display name
+        self.resolved = {}  # raw PPM name -> (code, match)
+        self.longest_first = None
+
+    def add(self, name, code):
+        if not name or not code:
+            return
+        self.names.setdefault(code, name)
+        normalized = normalize_name(name)
+        for key in (normalized, chinese_part(normalized)):
+            if key:
+                self.codes.setdefault(key, code)
+        self.longest_first = None
+
+    def resolve(self, name):
+        """Return (code, 'name' | 'contained') or ('', 'none'), once per distinct name"""
+        if name not in self.resolved:
+            self.resolved[name] = self._resolve(name)
+        return self.resolved[name]
+
+    def _resolve(self, name):
+        normalized = normalize_name(name)
+        for key in (normalized, chinese_part(normalized)):
+            if key in self.codes:
+                return self.codes[key], 'name'
+        # Product-style names such as '75% 三賽唑可濕性粉劑' contain the common name
+        if self.longest_first is None:
+            self.longest_first = sorted((key for key in self.codes if len(key) >= 2), key=len, reverse=True)
+        for key in self.longest_first:
+            if key in normalized:
+                return self.codes[key], 'contained'
+        return '', 'none'
+
+
+class AphiaIndex:
+    """Hash indexes over APHIA usage ranges: code -> normalized crop -> rows"""
+
+    def __init__(self):
+        self.by_code = {}
+        self.matched = set()  # ids of rows joined to at least one PPM row
+        self.rows = []
+
+    def add(self, row, source_file):
+        code = row.get('pesticide_code', '')
+        entry = {
+            'id': len(self.rows),
+            'code': code,
+            'crop_key': normalize_name(row.get('crop', '')),
+            'pest_key': normalize_name(row.get('pest_disease', '')),
+            'pest_tokens': name_tokens(row.get('pest_disease', '')),
+            'fields': {
+                'aphia_crop': row.get('crop', ''),
+                'aphia_pest_disease': row.get('pest_disease', ''),
+                'aphia_dosage_per_hectare': row.get('dosage_per_hectare', ''),
+                'aphia_dilution_ratio': row.get('dilution_ratio', ''),
+                'aphia_pre_harvest_interval': row.get('pre_harvest_interval', ''),
+                'aphia_application_method': row.get('application_method', ''),
+                'aphia_source_file': source_file
+            }
+        }
+        self.rows.append(entry)
+        self.by_code.setdefault(code, {}).setdefault(entry['crop_key'], []).append(entry)
+
+    def match(self, code, crop_text, pest_text):
+        """Best APHIA rows for one PPM row, with (crop_match, pest_match) flags"""
+        crops = self.by_code.get(code)
+        if not crops:
+            return [], 'none', 'none'
+
+        crop_key = normalize_name(crop_text)
+        if crop_key in crops:
+            candidates, crop_match, remainder = crops[crop_key], 'exact', ''
+        else:
+            # PPM crop entries are often crop + pest, e.g. 玉米螟 for corn borer on corn
+            contained = [key for key in crops if key and key in crop_key]
+            if not contained:
+                return [], 'none', 'none'
+            best = max(contained, key=len)
+            candidates, crop_match, remainder = crops[best], 'contained', crop_key.replace(best, '', 1)
+
+        pest_key, pest_tokens = normalize_name(pest_text), name_tokens(pest_text)
+        if not pest_key and remainder:
+            # The pest is the rest of the crop entry, or the whole entry, e.g. 玉米螟
+            pest_key, pest_tokens = remainder, frozenset({remainder, crop_key})
+        if not pest_key:
+            return candidates, crop_match, 'absent'
+        exact = [row for row in candidates if row['pest_key'] == pest_key]
+        if exact:
+            return exact, crop_match, 'exact'
+        # Whole list entries must match; substrings would pair 病2 with 病21
+        partial = [row for row in candidates if row['pest_tokens'] & pest_tokens]
+        if partial:
+            return partial, crop_match, 'contained'
+        return candidates, crop_match, 'none'
+
+
+def match_quality(pesticide_match, crop_match, pest_match):
+    if pesticide_match == 'none':
+        return 'unresolved_pesticide'
+    if crop_match == 'none':
+        return 'pesticide_only'
+    if pesticide_match == 'name' and crop_match == 'exact' and pest_match == 'exact':
+        return 'exact'
+    if pest_match in ('exact', 'contained'):
+        return 'crop_and_pest'
+    return 'crop_only'
+
+
+def load_aphia_index(data_dir, names):
+    index = AphiaIndex()
+    for file_path in dataset_files('usage_ranges', data_dir):
+        source_file = os.path.relpath(file_path, data_dir)
+        for row in read_rows(file_path):
+            names.add(row.get('pesticide_name', ''), row.get('pesticide_code', ''))
+            index.add(row, source_file)
+    return index
+
+
+def join_usage(data_dir='data', output_path=None):
+    """Write the merged usage table, returns counts per match quality"""
+    output_path = output_path or os.path.join(EXPORT_DIR, 'merged_usage.csv')
+    names = PesticideNames()
+    list_path = in_data_dir(PESTICIDE_LIST_PATH, data_dir)
+    if os.path.exists(list_path):
+        for row in read_rows(list_path):
+            names.add(row.get('農藥名稱', ''), row.get('代號', ''))
+
+    index = load_aphia_index(data_dir, names)
+    print(f"Indexed {len(index.rows)} APHIA usage rows for {len(index.by_code)} pesticides")
+
+    counts = {}
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+        writer.writeheader()
+
+        def emit(row, quality):
+            writer.writerow(row)
+            counts[quality] = counts.get(quality, 0) + 1
+
+        for file_path in dataset_files('crop_usage', data_dir):
+            source_file = os.path.relpath(file_path, data_dir)
+            columns = None
+            for row in read_rows(file_path):
+                if columns is None:
+                    columns = list(row)
+                    pesticide_column = find_column(columns, ('藥劑',))
+                    pest_column = find_column(columns, ('病', '蟲', '害'), exclude=(pesticide_column,))
+                    tolerance_column = find_column(columns, ('容許量',))
+                    dilution_column = find_column(columns, ('稀釋',))
+                    phi_column = find_column(columns, ('安全採收期',))
+
+                ppm = {
+                    'ppm_pesticide': row.get(pesticide_column, '') if pesticide_column else '',
+                    'ppm_crop': row.get('作物名稱', ''),
+                    'ppm_pest': row.get(pest_column, '') if pest_column else '',
+                    'ppm_tolerance': row.get(tolerance_column, '') if tolerance_column else '',
+                    'ppm_dilution': row.get(dilution_column, '') if dilution_column else '',
+                    'ppm_phi': row.get(phi_column, '') if phi_column else '',
+                    'ppm_source_file': source_file
+                }
+                code, pesticide_match = names.resolve(ppm['ppm_pesticide'])
+                matches, crop_match, pest_match = index.match(code, ppm['ppm_crop'], ppm['ppm_pest'])
+                quality = match_quality(pesticide_match, crop_match, pest_match)
+                base = {
+                    'pesticide_code': code,
+                    'pesticide_name': names.names.get(code, ''),
+                    'match_quality': quality,
+                    'pesticide_match': pesticide_match,
+                    'crop_match': crop_match,
+                    'pest_match': pest_match,
+                    **ppm
+                }
+                if not matches:
+                    emit({**base, 'source': 'ppm'}, quality)
+                    continue
+                for match in matches:
+                    index.matched.add(match['id'])
+                    emit({**base, 'source': 'both', **match['fields']}, quality)
+
+        # APHIA usage ranges with no PPM counterpart
+        for entry in index.rows:
+            if entry['id'] in index.matched:
+                continue
+            emit({
+                'pesticide_code': entry['code'],
+                'pesticide_name': names.names.get(entry['code'], ''),
+                'source': 'aphia',
+                'match_quality': 'aphia_only',
+                **entry['fields']
+            }, 'aphia_only')
+
+    print(f"Saved merged usage table to {output_path}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Join PPM crop usage with APHIA usage ranges into one table')
+    parser.add_argument('--data-dir', default='data',
+                        help='Root of the scraped data tree (default: data)')
+    parser.add_argument('--output',
+                        help=f'Output CSV (default: {EXPORT_DIR}/merged_usage.csv)')
+
+    args = parser.parse_args()
+    counts = join_usage(args.data_dir, args.output)
+
+    print(f"\n=== Match Quality ===")
+    for quality, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {quality}: {count}")
+
+
+if __name__ == '__main__':
+    main()